@@ -11,6 +11,10 @@ import { environment } from 'src/environments/environment';
 })
 export class RegisterComponent implements OnInit {
   submitting: boolean = false;
+  // sent with every attempt to register the same tenant, so a retry resumes the
+  // registration instead of starting a new one
+  idempotencyToken: string = '';
+  idempotencyTokenTenant: string = '';
   tenantForm: FormGroup = this.fb.group({
     tenantName: ['', [Validators.required]],
     tenantEmail: ['', [Validators.email, Validators.required]],
@@ -36,8 +40,15 @@ export class RegisterComponent implements OnInit {
   submit() {
     this.submitting = true;
     this.tenantForm.disable();
+    const { tenantName, tenantEmail, tenantTier } = this.tenantForm.value;
+    const idempotencyTokenTenant = JSON.stringify([tenantName, tenantEmail, tenantTier]);
+    if (idempotencyTokenTenant !== this.idempotencyTokenTenant) {
+      this.idempotencyToken = crypto.randomUUID();
+      this.idempotencyTokenTenant = idempotencyTokenTenant;
+    }
     const tenant = {
       ...this.tenantForm.value,
+      idempotencyToken: this.idempotencyToken,
     };
     this.http
       .post(`${environment.apiGatewayUrl}/registration`, tenant)
@@ -45,6 +56,7 @@ export class RegisterComponent implements OnInit {
         next: () => {
           this.openErrorMessageSnackBar('Successfully created new tenant!');
           this.tenantForm.reset();
+          this.idempotencyTokenTenant = '';
           this.tenantForm.enable();
           this.submitting = false;
         },
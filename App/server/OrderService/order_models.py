@@ -1,21 +1,80 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+from types import SimpleNamespace
+
 class Order:
-    key=''
+    # slotted, as lists of thousands of orders are built per request
+    __slots__ = ('shardId', 'orderId', 'orderName', 'orderProducts', '_key')
+
     def __init__(self, shardId, orderId, orderName, orderProducts):
         self.shardId = shardId
         self.orderId = orderId
-        self.key = shardId + ':' +  orderId
         self.orderName = orderName
         self.orderProducts = orderProducts
+        self._key = None
+
+    @property
+    def key(self):
+        if self._key is None:
+            self._key = self.shardId + ':' +  self.orderId
+        return self._key
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(item['shardId'], item['orderId'], item['orderName'], item['orderProducts'])
+
+    def to_item(self):
+        return {
+            'shardId': self.shardId,
+            'orderId': self.orderId,
+            'orderName': self.orderName,
+            'orderProducts': to_order_product_items(self.orderProducts)
+        }
+
+    def to_dict(self):
+        return {
+            'shardId': self.shardId,
+            'orderId': self.orderId,
+            'key': self.key,
+            'orderName': self.orderName,
+            'orderProducts': self.orderProducts
+        }
+
+    def __getstate__(self):
+        return self.to_dict()
 
 class  OrderProduct:
+    __slots__ = ('productId', 'price', 'quantity')
 
     def __init__(self, productId, price, quantity):
         self.productId = productId
         self.price = price
         self.quantity = quantity
 
+    @classmethod
+    def from_item(cls, item):
+        return cls(item['productId'], item['price'], item['quantity'])
+
+    def to_item(self):
+        return {'productId': self.productId, 'price': self.price, 'quantity': self.quantity}
+
+    def to_dict(self):
+        return {'productId': self.productId, 'price': self.price, 'quantity': self.quantity}
 
+    def __getstate__(self):
+        return self.to_dict()
 
+def to_order_product_items(orderProducts):
+    """ Converts the order products of a request payload (namespaces), of an item (dicts)
+        or models to the maps stored in DynamoDB
+    """
+    items = []
+    for orderProduct in orderProducts:
+        if isinstance(orderProduct, SimpleNamespace):
+            items.append(vars(orderProduct))
+        elif isinstance(orderProduct, OrderProduct):
+            items.append(orderProduct.to_item())
+        else:
+            items.append(orderProduct)
+    return items
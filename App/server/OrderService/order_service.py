@@ -1,97 +1,169 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import os
 import json
 import utils
 import logger
 import metrics_manager
 import order_service_dal
+import shard_paginator
 from decimal import Decimal
 from types import SimpleNamespace
 from aws_lambda_powertools import Tracer
 tracer = Tracer()
 
+# items or keys accepted by one batch request
+batch_max_request_items = int(os.environ.get('BATCH_MAX_REQUEST_ITEMS', '1000'))
+
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetOrderExecutionTimeMs")
 def get_order(event, context):
-
-    timestampStart = utils.getUTCEpoch()
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
+
     logger.log_message(event, "Request received to get a order")
     params = event['pathParameters']
-    key = params['id']
     logger.log_message(event, params)
-    order = order_service_dal.get_order(event, key)
+    key = params['id']
+    logger.log_message(event, key)
+    with metrics_manager.record_duration(event, "GetOrderDalTimeMs"):
+        order = order_service_dal.get_order(event, key)
     logger.log_message(event, "Request completed to get a order")
-    timestampEnd = utils.getUTCEpoch()
     metrics_manager.record_metric(event, "SingleOrderRequested", "Count", 1)
-    metrics_manager.record_metric(event, "GetOrderExecutionTime", "Seconds", timestampEnd-timestampStart)
-    return utils.generate_response(order)
-    
+    with metrics_manager.record_duration(event, "GetOrderSerializeTimeMs"):
+        return utils.generate_response(order)
+
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("CreateOrderExecutionTimeMs")
 def create_order(event, context):
-    timestampStart = utils.getUTCEpoch()
-
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
 
     logger.log_message(event, "Request received to create a order")
-    payload = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
-    order = order_service_dal.create_order(event, payload)
+    with metrics_manager.record_duration(event, "CreateOrderParseTimeMs"):
+        payload = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
+    with metrics_manager.record_duration(event, "CreateOrderDalTimeMs"):
+        order = order_service_dal.create_order(event, payload)
     logger.log_message(event, "Request completed to create a order")
-    timestampEnd = utils.getUTCEpoch()
     metrics_manager.record_metric(event, "OrderCreated", "Count", 1)
-    metrics_manager.record_metric(event, "CreateOrderExecutionTime", "Seconds", timestampEnd-timestampStart)    
-    return utils.generate_response(order)
-    
+    with metrics_manager.record_duration(event, "CreateOrderSerializeTimeMs"):
+        return utils.generate_response(order)
+
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("UpdateOrderExecutionTimeMs")
 def update_order(event, context):
-    timestampStart = utils.getUTCEpoch()
-
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
-    
+
     logger.log_message(event, "Request received to update a order")
-    payload = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
+    with metrics_manager.record_duration(event, "UpdateOrderParseTimeMs"):
+        payload = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
     params = event['pathParameters']
     key = params['id']
-    order = order_service_dal.update_order(event, payload, key)
+    with metrics_manager.record_duration(event, "UpdateOrderDalTimeMs"):
+        order = order_service_dal.update_order(event, payload, key)
     logger.log_message(event, "Request completed to update a order")
-    timestampEnd = utils.getUTCEpoch() 
     metrics_manager.record_metric(event, "OrderUpdated", "Count", 1)
-    metrics_manager.record_metric(event, "UpdateOrderExecutionTime", "Seconds", timestampEnd-timestampStart)    
-    return utils.generate_response(order)
+    with metrics_manager.record_duration(event, "UpdateOrderSerializeTimeMs"):
+        return utils.generate_response(order)
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("DeleteOrderExecutionTimeMs")
 def delete_order(event, context):
-    timestampStart = utils.getUTCEpoch()
-
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
 
     logger.log_message(event, "Request received to delete a order")
     params = event['pathParameters']
     key = params['id']
-    response = order_service_dal.delete_order(event, key)
+    with metrics_manager.record_duration(event, "DeleteOrderDalTimeMs"):
+        response = order_service_dal.delete_order(event, key)
     logger.log_message(event, "Request completed to delete a order")
-    timestampEnd = utils.getUTCEpoch()
     metrics_manager.record_metric(event, "OrderDeleted", "Count", 1)
-    metrics_manager.record_metric(event, "DeleteOrderExecutionTime", "Seconds", timestampEnd-timestampStart)    
     return utils.create_success_response("Successfully deleted the order")
 
 @tracer.capture_lambda_handler
-def get_orders(event, context):
-    timestampStart = utils.getUTCEpoch()
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("CreateOrdersBatchExecutionTimeMs")
+def create_orders_batch(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
 
+    logger.log_message(event, "Request received to create a batch of orders")
+    with metrics_manager.record_duration(event, "CreateOrdersBatchParseTimeMs"):
+        payloads = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
+    if (not isinstance(payloads, list) or len(payloads) == 0 or len(payloads) > batch_max_request_items):
+        return utils.create_badrequest_response("Request body must be a list of 1 to {0} orders".format(batch_max_request_items))
+
+    with metrics_manager.record_duration(event, "CreateOrdersBatchDalTimeMs"):
+        results = order_service_dal.create_orders(event, payloads)
+    created = len([result for result in results if result['succeeded']])
+    logger.log_message(event, "Request completed to create a batch of orders")
+    metrics_manager.record_metric(event, "OrderCreated", "Count", created)
+    with metrics_manager.record_duration(event, "CreateOrdersBatchSerializeTimeMs"):
+        return utils.generate_response({'created': created, 'failed': len(results) - created, 'results': results})
+
+@tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetOrdersBatchExecutionTimeMs")
+def get_orders_batch(event, context):
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
-    
+
+    logger.log_message(event, "Request received to get a batch of orders")
+    with metrics_manager.record_duration(event, "GetOrdersBatchParseTimeMs"):
+        body = json.loads(event['body'])
+    keys = body.get('keys') if isinstance(body, dict) else None
+    if (not isinstance(keys, list) or len(keys) == 0 or len(keys) > batch_max_request_items):
+        return utils.create_badrequest_response("Request body must have a list of 1 to {0} keys".format(batch_max_request_items))
+
+    with metrics_manager.record_duration(event, "GetOrdersBatchDalTimeMs"):
+        orders, not_found, failed = order_service_dal.get_orders_by_keys(event, [str(key) for key in keys])
+    metrics_manager.record_metric(event, "OrdersRetrieved", "Count", len(orders))
+    logger.log_message(event, "Request completed to get a batch of orders")
+    with metrics_manager.record_duration(event, "GetOrdersBatchSerializeTimeMs"):
+        return utils.generate_response({'orders': orders, 'notFound': not_found, 'failed': failed})
+
+@tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetOrdersExecutionTimeMs")
+def get_orders(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
+
     logger.log_message(event, "Request received to get all orders")
-    response = order_service_dal.get_orders(event, tenantId)
+    pagination = utils.get_pagination_parameters(event)
+    if (pagination is not None):
+        return __get_orders_page(event, tenantId, *pagination)
+
+    with metrics_manager.record_duration(event, "GetOrdersDalTimeMs"):
+        response = order_service_dal.get_orders(event, tenantId)
     metrics_manager.record_metric(event, "OrdersRetrieved", "Count", len(response))
-    timestampEnd = utils.getUTCEpoch()
     logger.log_message(event, "Request completed to get all orders")
-    metrics_manager.record_metric(event, "GetOrdersExecutionTime", "Seconds", timestampEnd-timestampStart)    
-    return utils.generate_response(response)
+    with metrics_manager.record_duration(event, "GetOrdersSerializeTimeMs"):
+        return utils.generate_response(response)
 
-  
\ No newline at end of file
+def __get_orders_page(event, tenantId, limit, next_token):
+    try:
+        limit = shard_paginator.parse_limit(limit)
+        with metrics_manager.record_duration(event, "GetOrdersDalTimeMs"):
+            response, next_token = order_service_dal.get_orders_page(event, tenantId, limit, next_token)
+    except ValueError:
+        logger.log_message(event, "Invalid pagination parameters")
+        return utils.create_badrequest_response("Invalid limit or nextToken")
+    metrics_manager.record_metric(event, "OrdersRetrieved", "Count", len(response))
+    logger.log_message(event, "Request completed to get a page of orders")
+    with metrics_manager.record_duration(event, "GetOrdersSerializeTimeMs"):
+        return utils.generate_response({'items': response, 'nextToken': next_token})
@@ -6,20 +6,22 @@ import os
 import boto3
 from botocore.exceptions import ClientError
 import uuid
-from order_models import Order
+from order_models import Order, to_order_product_items
 import json
 import utils
 from types import SimpleNamespace
 import logger
-import random
-import threading
+import dynamodb_manager
+import shard_manager
+import scatter_gather
+import shard_paginator
 from boto3.dynamodb.conditions import Key
 
 table_name = os.environ['ORDER_TABLE_NAME']
 dynamodb = None
 
-suffix_start = 1 
-suffix_end = 10
+# overall time allowed to read all partitions of a tenant, within the 29 seconds of API Gateway
+partition_query_timeout_seconds = int(os.environ.get('PARTITION_QUERY_TIMEOUT_SECONDS', '20'))
  
 
 def get_order(event, key):
@@ -32,7 +34,7 @@ def get_order(event, key):
         logger.log_message(event, orderId)
         response = table.get_item(Key={'shardId': shardId, 'orderId': orderId})
         item = response['Item']
-        order = Order(item['shardId'], item['orderId'], item['orderName'], item['orderProducts'])
+        order = Order.from_item(item)
 
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
@@ -58,18 +60,14 @@ def delete_order(event, key):
 def create_order(event, payload):
     tenantId = event['requestContext']['authorizer']['tenantId']
     table = __get_dynamodb_table(event, dynamodb)
-    suffix = random.randrange(suffix_start, suffix_end)
-    shardId = tenantId+"-"+str(suffix)
+    # the shard is derived from the item id, so the item always routes to the same shard
+    orderId = str(uuid.uuid4())
+    shardId = shard_manager.get_shard_id(tenantId, orderId, shard_manager.get_shard_count(event))
     
-    order = Order(shardId, str(uuid.uuid4()), payload.orderName, payload.orderProducts)
+    order = Order(shardId, orderId, payload.orderName, payload.orderProducts)
 
     try:
-        response = table.put_item(Item={
-        'shardId':shardId,
-        'orderId': order.orderId, 
-        'orderName': order.orderName,
-        'orderProducts': get_order_products_dict(order.orderProducts)
-        })
+        response = table.put_item(Item=order.to_item())
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
         raise Exception('Error adding a order', e)
@@ -77,6 +75,54 @@ def create_order(event, payload):
         logger.info("PutItem succeeded:")
         return order
 
+def create_orders(event, payloads):
+    """ Creates the orders with BatchWriteItem
+
+    Returns:
+        A result per payload, in order, with the key of the order and whether it was created
+    """
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    table = __get_dynamodb_table(event, dynamodb)
+    shard_count = shard_manager.get_shard_count(event)
+
+    orders = []
+    for payload in payloads:
+        orderId = str(uuid.uuid4())
+        shardId = shard_manager.get_shard_id(tenantId, orderId, shard_count)
+        orders.append(Order(shardId, orderId, payload.orderName, payload.orderProducts))
+
+    failures = dynamodb_manager.batch_write_items(table, [order.to_item() for order in orders])
+    errors = {failure['item']['orderId']: failure['error'] for failure in failures}
+    logger.info("BatchWriteItem completed: {0} of {1} orders created".format(len(orders) - len(errors), len(orders)))
+    return [__get_batch_result(order.key, errors.get(order.orderId)) for order in orders]
+
+def get_orders_by_keys(event, keys):
+    """ Gets the orders with the keys (shardId:orderId) with BatchGetItem
+
+    Returns:
+        The orders found, the keys not found and the keys that could not be read
+    """
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    table = __get_dynamodb_table(event, dynamodb)
+
+    item_keys = []
+    failed = []
+    for key in dict.fromkeys(keys):
+        key_parts = key.split(":")
+        if (len(key_parts) != 2 or not key_parts[0].startswith(tenantId + '-')):
+            failed.append(__get_batch_result(key, 'InvalidKey'))
+        else:
+            item_keys.append({'shardId': key_parts[0], 'orderId': key_parts[1]})
+
+    items, failures = dynamodb_manager.batch_get_items(table, item_keys)
+    orders = [Order.from_item(item) for item in items]
+    failed.extend(__get_batch_result(failure['key']['shardId'] + ':' + failure['key']['orderId'], failure['error']) for failure in failures)
+
+    found_keys = set(order.key for order in orders) | set(result['key'] for result in failed)
+    not_found = [key for key in dict.fromkeys(keys) if key not in found_keys]
+    logger.info("BatchGetItem completed: {0} orders found".format(len(orders)))
+    return orders, not_found, failed
+
 def update_order(event, payload, key):
     table = __get_dynamodb_table(event, dynamodb)
     
@@ -103,10 +149,9 @@ def update_order(event, payload, key):
 
 def get_orders(event, tenantId):
     table = __get_dynamodb_table(event, dynamodb)
-    get_all_products_response = []
 
     try:
-        __query_all_partitions(tenantId,get_all_products_response, table)
+        get_all_products_response = __query_all_partitions(event, tenantId, table)
     except ClientError as e:
         logger.error('Error getting all orders')
         raise Exception('Error getting all orders', e) 
@@ -114,29 +159,37 @@ def get_orders(event, tenantId):
         logger.info("Get orders succeeded")
         return get_all_products_response
 
-def __query_all_partitions(tenantId,get_all_products_response, table):
-    threads = []    
+def get_orders_page(event, tenantId, limit, next_token=None):
+    table = __get_dynamodb_table(event, dynamodb)
+    try:
+        items, next_token = shard_paginator.query_page(table, 'shardId', 'orderId', 
+            shard_manager.get_partition_ids(tenantId, shard_manager.get_shard_count(event)), 
+            limit, next_token, timeout_seconds=partition_query_timeout_seconds)
+    except ClientError as e:
+        logger.error('Error getting all orders')
+        raise Exception('Error getting a page of orders', e)
+    else:
+        logger.info("Get page of orders succeeded")
+        return [Order.from_item(item) for item in items], next_token
+
+def __query_all_partitions(event, tenantId, table):
+    partition_ids = shard_manager.get_partition_ids(tenantId, shard_manager.get_shard_count(event))
+    
+    # query the partitions concurrently on the shared pool, each one until its last page
+    partitions = scatter_gather.scatter_gather(lambda partition_id, deadline: __get_tenant_data(partition_id, table, deadline), 
+        partition_ids, timeout_seconds=partition_query_timeout_seconds)
     
-    for suffix in range(suffix_start, suffix_end):
-        partition_id = tenantId+'-'+str(suffix)
-        
-        thread = threading.Thread(target=__get_tenant_data, args=[partition_id, get_all_products_response, table])
-        threads.append(thread)
-        
-    # Start threads
-    for thread in threads:
-        thread.start()
-    # Ensure all threads are finished
-    for thread in threads:
-        thread.join()
+    return [order for partition in partitions for order in partition]
            
-def __get_tenant_data(partition_id, get_all_products_response, table):    
+def __get_tenant_data(partition_id, table, deadline):    
     logger.info(partition_id)
-    response = table.query(KeyConditionExpression=Key('shardId').eq(partition_id))    
-    if (len(response['Items']) > 0):
-        for item in response['Items']:
-            order = Order(item['shardId'], item['orderId'], item['orderName'], item['orderProducts'])
-            get_all_products_response.append(order)
+    items = scatter_gather.query_all_pages(table, deadline, KeyConditionExpression=Key('shardId').eq(partition_id))
+    return [Order.from_item(item) for item in items]
+
+def __get_batch_result(key, error):
+    if (error is None):
+        return {'key': key, 'succeeded': True}
+    return {'key': key, 'succeeded': False, 'error': error}
 
 def __get_dynamodb_table(event, dynamodb):
     """ Determine the table name based upo pooled vs silo model
@@ -147,23 +200,10 @@ def __get_dynamodb_table(event, dynamodb):
     Returns:
         [type]: [description]
     """
-    accesskey = event['requestContext']['authorizer']['accesskey']
-    secretkey = event['requestContext']['authorizer']['secretkey']
-    sessiontoken = event['requestContext']['authorizer']['sessiontoken']    
-    dynamodb = boto3.resource('dynamodb',
-            aws_access_key_id=accesskey,
-            aws_secret_access_key=secretkey,
-            aws_session_token=sessiontoken
-            )
-        
-    return dynamodb.Table(table_name)
+    return dynamodb_manager.get_table(event, table_name)
 
 def get_order_products_dict(orderProducts):
-    orderProductList = []
-    for i in range(len(orderProducts)):
-        product = orderProducts[i]
-        orderProductList.append(vars(product))
-    return orderProductList    
+    return to_order_product_items(orderProducts)    
 
   
 
@@ -2,24 +2,68 @@
 # SPDX-License-Identifier: MIT-0
 
 class Product:
-    key =''
+    # slotted, as lists of thousands of products are built per request
+    __slots__ = ('shardId', 'productId', 'sku', 'name', 'price', 'category', '_key')
+
     def __init__(self, shardId, productId, sku, name, price, category):
         self.shardId = shardId
         self.productId = productId
-        self.key = shardId + ':' +  productId
         self.sku = sku
         self.name = name
         self.price = price
         self.category = category
+        self._key = None
+
+    @property
+    def key(self):
+        if self._key is None:
+            self._key = self.shardId + ':' +  self.productId
+        return self._key
+
+    @classmethod
+    def from_item(cls, item):
+        return cls(item['shardId'], item['productId'], item['sku'], item['name'], item['price'], item['category'])
+
+    def to_item(self):
+        return {
+            'shardId': self.shardId,
+            'productId': self.productId,
+            'sku': self.sku,
+            'name': self.name,
+            'price': self.price,
+            'category': self.category
+        }
+
+    def to_dict(self):
+        return {
+            'shardId': self.shardId,
+            'productId': self.productId,
+            'key': self.key,
+            'sku': self.sku,
+            'name': self.name,
+            'price': self.price,
+            'category': self.category
+        }
+
+    def __getstate__(self):
+        return self.to_dict()
 
 class Category:
+    __slots__ = ('id', 'name')
+
     def __init__(self, id, name):
         self.id = id
         self.name = name
-                
 
-        
+    @classmethod
+    def from_item(cls, item):
+        return cls(item['id'], item['name'])
+
+    def to_item(self):
+        return {'id': self.id, 'name': self.name}
 
-               
+    def to_dict(self):
+        return {'id': self.id, 'name': self.name}
 
-        
+    def __getstate__(self):
+        return self.to_dict()
@@ -1,99 +1,169 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import os
 import json
 import utils
 import logger
 import metrics_manager
 import product_service_dal
+import shard_paginator
 from decimal import Decimal
 from aws_lambda_powertools import Tracer
 from types import SimpleNamespace
 tracer = Tracer()
 
+# items or keys accepted by one batch request
+batch_max_request_items = int(os.environ.get('BATCH_MAX_REQUEST_ITEMS', '1000'))
+
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetProductExecutionTimeMs")
 def get_product(event, context):
-    timestampStart = utils.getUTCEpoch()
-    
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
-    
+
     logger.log_message(event, "Request received to get a product")
     params = event['pathParameters']
     logger.log_message(event, params)
     key = params['id']
     logger.log_message(event, key)
-    product = product_service_dal.get_product(event, key)
-    timestampEnd = utils.getUTCEpoch()
-    metrics_manager.record_metric(event, "GetProductExecutionTime", "Seconds", timestampEnd-timestampStart)    
+    with metrics_manager.record_duration(event, "GetProductDalTimeMs"):
+        product = product_service_dal.get_product(event, key)
     logger.log_message(event, "Request completed to get a product")
     metrics_manager.record_metric(event, "SingleProductRequested", "Count", 1)
-    return utils.generate_response(product)
-    
+    with metrics_manager.record_duration(event, "GetProductSerializeTimeMs"):
+        return utils.generate_response(product)
+
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("CreateProductExecutionTimeMs")
 def create_product(event, context):
-    timestampStart = utils.getUTCEpoch()
-
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
 
     logger.log_message(event, "Request received to create a product")
-    payload = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
-    product = product_service_dal.create_product(event, payload)
-    timestampEnd = utils.getUTCEpoch()
-    metrics_manager.record_metric(event, "CreateProductExecutionTime", "Seconds", timestampEnd-timestampStart)    
+    with metrics_manager.record_duration(event, "CreateProductParseTimeMs"):
+        payload = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
+    with metrics_manager.record_duration(event, "CreateProductDalTimeMs"):
+        product = product_service_dal.create_product(event, payload)
     logger.log_message(event, "Request completed to create a product")
     metrics_manager.record_metric(event, "ProductCreated", "Count", 1)
-    return utils.generate_response(product)
-    
+    with metrics_manager.record_duration(event, "CreateProductSerializeTimeMs"):
+        return utils.generate_response(product)
+
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("UpdateProductsExecutionTimeMs")
 def update_product(event, context):
-    timestampStart = utils.getUTCEpoch()
-
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
 
     logger.log_message(event, "Request received to update a product")
-    payload = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
+    with metrics_manager.record_duration(event, "UpdateProductParseTimeMs"):
+        payload = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
     params = event['pathParameters']
     key = params['id']
-    product = product_service_dal.update_product(event, payload, key)
-    timestampEnd = utils.getUTCEpoch()
-    metrics_manager.record_metric(event, "UpdateProductsExecutionTime", "Seconds", timestampEnd-timestampStart)    
-    logger.log_message(event, "Request completed to update a product") 
-    metrics_manager.record_metric(event, "ProductUpdated", "Count", 1)   
-    return utils.generate_response(product)
+    with metrics_manager.record_duration(event, "UpdateProductDalTimeMs"):
+        product = product_service_dal.update_product(event, payload, key)
+    logger.log_message(event, "Request completed to update a product")
+    metrics_manager.record_metric(event, "ProductUpdated", "Count", 1)
+    with metrics_manager.record_duration(event, "UpdateProductSerializeTimeMs"):
+        return utils.generate_response(product)
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("DeleteProductExecutionTimeMs")
 def delete_product(event, context):
-    timestampStart = utils.getUTCEpoch()
-
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
 
     logger.log_message(event, "Request received to delete a product")
     params = event['pathParameters']
     key = params['id']
-    response = product_service_dal.delete_product(event, key)
-    timestampEnd = utils.getUTCEpoch()
+    with metrics_manager.record_duration(event, "DeleteProductDalTimeMs"):
+        response = product_service_dal.delete_product(event, key)
     logger.log_message(event, "Request completed to delete a product")
-    metrics_manager.record_metric(event, "GetProductsExecutionTime", "Seconds", timestampEnd-timestampStart)    
     metrics_manager.record_metric(event, "ProductDeleted", "Count", 1)
     return utils.create_success_response("Successfully deleted the product")
 
 @tracer.capture_lambda_handler
-def get_products(event, context):
-    timestampStart = utils.getUTCEpoch()
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("CreateProductsBatchExecutionTimeMs")
+def create_products_batch(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
+
+    logger.log_message(event, "Request received to create a batch of products")
+    with metrics_manager.record_duration(event, "CreateProductsBatchParseTimeMs"):
+        payloads = json.loads(event['body'], object_hook=lambda d: SimpleNamespace(**d), parse_float=Decimal)
+    if (not isinstance(payloads, list) or len(payloads) == 0 or len(payloads) > batch_max_request_items):
+        return utils.create_badrequest_response("Request body must be a list of 1 to {0} products".format(batch_max_request_items))
+
+    with metrics_manager.record_duration(event, "CreateProductsBatchDalTimeMs"):
+        results = product_service_dal.create_products(event, payloads)
+    created = len([result for result in results if result['succeeded']])
+    logger.log_message(event, "Request completed to create a batch of products")
+    metrics_manager.record_metric(event, "ProductCreated", "Count", created)
+    with metrics_manager.record_duration(event, "CreateProductsBatchSerializeTimeMs"):
+        return utils.generate_response({'created': created, 'failed': len(results) - created, 'results': results})
 
+@tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetProductsBatchExecutionTimeMs")
+def get_products_batch(event, context):
     tenantId = event['requestContext']['authorizer']['tenantId']
     tracer.put_annotation(key="TenantId", value=tenantId)
-    
+
+    logger.log_message(event, "Request received to get a batch of products")
+    with metrics_manager.record_duration(event, "GetProductsBatchParseTimeMs"):
+        body = json.loads(event['body'])
+    keys = body.get('keys') if isinstance(body, dict) else None
+    if (not isinstance(keys, list) or len(keys) == 0 or len(keys) > batch_max_request_items):
+        return utils.create_badrequest_response("Request body must have a list of 1 to {0} keys".format(batch_max_request_items))
+
+    with metrics_manager.record_duration(event, "GetProductsBatchDalTimeMs"):
+        products, not_found, failed = product_service_dal.get_products_by_keys(event, [str(key) for key in keys])
+    metrics_manager.record_metric(event, "ProductsRetrieved", "Count", len(products))
+    logger.log_message(event, "Request completed to get a batch of products")
+    with metrics_manager.record_duration(event, "GetProductsBatchSerializeTimeMs"):
+        return utils.generate_response({'products': products, 'notFound': not_found, 'failed': failed})
+
+@tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetProductsExecutionTimeMs")
+def get_products(event, context):
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    tracer.put_annotation(key="TenantId", value=tenantId)
+
     logger.log_message(event, "Request received to get all products")
-    response = product_service_dal.get_products(event, tenantId)
-    timestampEnd = utils.getUTCEpoch()
-    metrics_manager.record_metric(event, "GetProductsExecutionTime", "Seconds", timestampEnd-timestampStart)    
+    pagination = utils.get_pagination_parameters(event)
+    if (pagination is not None):
+        return __get_products_page(event, tenantId, *pagination)
+
+    with metrics_manager.record_duration(event, "GetProductsDalTimeMs"):
+        response = product_service_dal.get_products(event, tenantId)
     metrics_manager.record_metric(event, "ProductsRetrieved", "Count", len(response))
     logger.log_message(event, "Request completed to get all products")
-    return utils.generate_response(response)
+    with metrics_manager.record_duration(event, "GetProductsSerializeTimeMs"):
+        return utils.generate_response(response)
 
-  
\ No newline at end of file
+def __get_products_page(event, tenantId, limit, next_token):
+    try:
+        limit = shard_paginator.parse_limit(limit)
+        with metrics_manager.record_duration(event, "GetProductsDalTimeMs"):
+            response, next_token = product_service_dal.get_products_page(event, tenantId, limit, next_token)
+    except ValueError:
+        logger.log_message(event, "Invalid pagination parameters")
+        return utils.create_badrequest_response("Invalid limit or nextToken")
+    metrics_manager.record_metric(event, "ProductsRetrieved", "Count", len(response))
+    logger.log_message(event, "Request completed to get a page of products")
+    with metrics_manager.record_duration(event, "GetProductsSerializeTimeMs"):
+        return utils.generate_response({'items': response, 'nextToken': next_token})
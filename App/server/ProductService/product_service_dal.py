@@ -8,8 +8,10 @@ from botocore.exceptions import ClientError
 import uuid
 import json
 import logger
-import random
-import threading
+import dynamodb_manager
+import shard_manager
+import scatter_gather
+import shard_paginator
 
 from product_models import Product
 from types import SimpleNamespace
@@ -19,8 +21,8 @@ from boto3.dynamodb.conditions import Key
 table_name = os.environ['PRODUCT_TABLE_NAME']
 dynamodb = None
 
-suffix_start = 1 
-suffix_end = 10
+# overall time allowed to read all partitions of a tenant, within the 29 seconds of API Gateway
+partition_query_timeout_seconds = int(os.environ.get('PARTITION_QUERY_TIMEOUT_SECONDS', '20'))
 
 def get_product(event, key):
     table = __get_dynamodb_table(event, dynamodb)
@@ -32,12 +34,12 @@ def get_product(event, key):
         logger.log_message(event, productId)
         response = table.get_item(Key={'shardId': shardId, 'productId': productId})
         item = response['Item']
-        product = Product(item['shardId'], item['productId'], item['sku'], item['name'], item['price'], item['category'])
+        product = Product.from_item(item)
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
         raise Exception('Error getting a product', e)
     else:
-        logger.info("GetItem succeeded:"+ str(product))
+        logger.info(lambda: "GetItem succeeded:"+ str(product))
         return product
 
 def delete_product(event, key):
@@ -60,23 +62,14 @@ def create_product(event, payload):
     table = __get_dynamodb_table(event, dynamodb)
 
     
-    suffix = random.randrange(suffix_start, suffix_end)
-    shardId = tenantId+"-"+str(suffix)
+    # the shard is derived from the item id, so the item always routes to the same shard
+    productId = str(uuid.uuid4())
+    shardId = shard_manager.get_shard_id(tenantId, productId, shard_manager.get_shard_count(event))
 
-    product = Product(shardId, str(uuid.uuid4()), payload.sku,payload.name, payload.price, payload.category)
+    product = Product(shardId, productId, payload.sku,payload.name, payload.price, payload.category)
     
     try:
-        response = table.put_item(
-            Item=
-                {
-                    'shardId': shardId,  
-                    'productId': product.productId,
-                    'sku': product.sku,
-                    'name': product.name,
-                    'price': product.price,
-                    'category': product.category
-                }
-        )
+        response = table.put_item(Item=product.to_item())
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
         raise Exception('Error adding a product', e)
@@ -84,6 +77,54 @@ def create_product(event, payload):
         logger.info("PutItem succeeded:")
         return product
 
+def create_products(event, payloads):
+    """ Creates the products with BatchWriteItem
+
+    Returns:
+        A result per payload, in order, with the key of the product and whether it was created
+    """
+    tenantId = event['requestContext']['authorizer']['tenantId']    
+    table = __get_dynamodb_table(event, dynamodb)
+    shard_count = shard_manager.get_shard_count(event)
+
+    products = []
+    for payload in payloads:
+        productId = str(uuid.uuid4())
+        shardId = shard_manager.get_shard_id(tenantId, productId, shard_count)
+        products.append(Product(shardId, productId, payload.sku, payload.name, payload.price, payload.category))
+
+    failures = dynamodb_manager.batch_write_items(table, [product.to_item() for product in products])
+    errors = {failure['item']['productId']: failure['error'] for failure in failures}
+    logger.info("BatchWriteItem completed: {0} of {1} products created".format(len(products) - len(errors), len(products)))
+    return [__get_batch_result(product.key, errors.get(product.productId)) for product in products]
+
+def get_products_by_keys(event, keys):
+    """ Gets the products with the keys (shardId:productId) with BatchGetItem
+
+    Returns:
+        The products found, the keys not found and the keys that could not be read
+    """
+    tenantId = event['requestContext']['authorizer']['tenantId']
+    table = __get_dynamodb_table(event, dynamodb)
+
+    item_keys = []
+    failed = []
+    for key in dict.fromkeys(keys):
+        key_parts = key.split(":")
+        if (len(key_parts) != 2 or not key_parts[0].startswith(tenantId + '-')):
+            failed.append(__get_batch_result(key, 'InvalidKey'))
+        else:
+            item_keys.append({'shardId': key_parts[0], 'productId': key_parts[1]})
+
+    items, failures = dynamodb_manager.batch_get_items(table, item_keys)
+    products = [Product.from_item(item) for item in items]
+    failed.extend(__get_batch_result(failure['key']['shardId'] + ':' + failure['key']['productId'], failure['error']) for failure in failures)
+
+    found_keys = set(product.key for product in products) | set(result['key'] for result in failed)
+    not_found = [key for key in dict.fromkeys(keys) if key not in found_keys]
+    logger.info("BatchGetItem completed: {0} products found".format(len(products)))
+    return products, not_found, failed
+
 def update_product(event, payload, key):
     table = __get_dynamodb_table(event, dynamodb)
     
@@ -114,9 +155,8 @@ def update_product(event, payload, key):
 
 def get_products(event, tenantId):    
     table = __get_dynamodb_table(event, dynamodb)
-    get_all_products_response =[]
     try:
-        __query_all_partitions(tenantId,get_all_products_response, table)
+        get_all_products_response = __query_all_partitions(event, tenantId, table)
     except ClientError as e:
         logger.error(e.response['Error']['Message'])
         raise Exception('Error getting all products', e)
@@ -124,38 +164,37 @@ def get_products(event, tenantId):
         logger.info("Get products succeeded")
         return get_all_products_response
 
-def __query_all_partitions(tenantId,get_all_products_response, table):
-    threads = []    
+def get_products_page(event, tenantId, limit, next_token=None):
+    table = __get_dynamodb_table(event, dynamodb)
+    try:
+        items, next_token = shard_paginator.query_page(table, 'shardId', 'productId', 
+            shard_manager.get_partition_ids(tenantId, shard_manager.get_shard_count(event)), 
+            limit, next_token, timeout_seconds=partition_query_timeout_seconds)
+    except ClientError as e:
+        logger.error(e.response['Error']['Message'])
+        raise Exception('Error getting a page of products', e)
+    else:
+        logger.info("Get page of products succeeded")
+        return [Product.from_item(item) for item in items], next_token
+
+def __query_all_partitions(event, tenantId, table):
+    partition_ids = shard_manager.get_partition_ids(tenantId, shard_manager.get_shard_count(event))
     
-    for suffix in range(suffix_start, suffix_end):
-        partition_id = tenantId+'-'+str(suffix)
-        
-        thread = threading.Thread(target=__get_tenant_data, args=[partition_id, get_all_products_response, table])
-        threads.append(thread)
-        
-    # Start threads
-    for thread in threads:
-        thread.start()
-    # Ensure all threads are finished
-    for thread in threads:
-        thread.join()
+    # query the partitions concurrently on the shared pool, each one until its last page
+    partitions = scatter_gather.scatter_gather(lambda partition_id, deadline: __get_tenant_data(partition_id, table, deadline), 
+        partition_ids, timeout_seconds=partition_query_timeout_seconds)
+    
+    return [product for partition in partitions for product in partition]
            
-def __get_tenant_data(partition_id, get_all_products_response, table):    
+def __get_tenant_data(partition_id, table, deadline):    
     logger.info(partition_id)
-    response = table.query(KeyConditionExpression=Key('shardId').eq(partition_id))    
-    if (len(response['Items']) > 0):
-        for item in response['Items']:
-            product = Product(item['shardId'], item['productId'], item['sku'], item['name'], item['price'], item['category'])
-            get_all_products_response.append(product)
+    items = scatter_gather.query_all_pages(table, deadline, KeyConditionExpression=Key('shardId').eq(partition_id))
+    return [Product.from_item(item) for item in items]
+
+def __get_batch_result(key, error):
+    if (error is None):
+        return {'key': key, 'succeeded': True}
+    return {'key': key, 'succeeded': False, 'error': error}
 
 def __get_dynamodb_table(event, dynamodb):    
-    accesskey = event['requestContext']['authorizer']['accesskey']
-    secretkey = event['requestContext']['authorizer']['secretkey']
-    sessiontoken = event['requestContext']['authorizer']['sessiontoken']    
-    dynamodb = boto3.resource('dynamodb',
-            aws_access_key_id=accesskey,
-            aws_secret_access_key=secretkey,
-            aws_session_token=sessiontoken
-            )       
-            
-    return dynamodb.Table(table_name)
+    return dynamodb_manager.get_table(event, table_name)
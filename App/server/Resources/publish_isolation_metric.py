@@ -1,34 +1,81 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import os
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import boto3
+from botocore.config import Config
 
 METRIC_NAMESPACE = "SaaSOperations"
 METRIC_NAME = "PotentialIsolationBreach"
 
-client = boto3.client('cloudwatch')
+# PutMetricData accepts at most 1000 datums per request
+PUT_METRIC_DATA_MAX_DATUMS = 1000
+# GetQueryResults returns at most 1000 rows per page
+GET_QUERY_RESULTS_MAX_RESULTS = 1000
+
+# throttled calls are retried by botocore with backoff and jitter
+retry_config = Config(retries={'max_attempts': int(os.environ.get('PUBLISH_MAX_ATTEMPTS', '8')), 'mode': 'adaptive'})
+client = boto3.client('cloudwatch', config=retry_config)
+athena_client = boto3.client('athena', config=retry_config)
+
+publish_max_workers = int(os.environ.get('PUBLISH_MAX_WORKERS', '4'))
 
 date_parser = lambda x: datetime.strptime(x, '%Y-%m-%d %H:%M:%S.%f')
 
 def lambda_handler(event, context):
+    values_by_timestamp = __get_values_by_timestamp(event['queryExecutionId'])
+    metric_data = [__get_metric_datum(timestamp, values) for timestamp, values in sorted(values_by_timestamp.items())]
 
-    metric_data = [
-        {
-            'MetricName': METRIC_NAME, 
-            'Timestamp': date_parser(row['Data'][0]['VarCharValue']), 
-            'Value': float(row['Data'][1]['VarCharValue']), 
-            'Unit': 'Count'
-        } for row in event['ResultSet']['Rows'][1:]
-    ]
-
-    if len(metric_data) > 0:
-        client.put_metric_data(
-            Namespace=METRIC_NAMESPACE,
-            MetricData=metric_data
-        )
+    chunks = [metric_data[i:i + PUT_METRIC_DATA_MAX_DATUMS] for i in range(0, len(metric_data), PUT_METRIC_DATA_MAX_DATUMS)]
+    if len(chunks) > 0:
+        with ThreadPoolExecutor(max_workers=min(publish_max_workers, len(chunks))) as executor:
+            # list() raises the first exception of the calls, once all of them completed
+            list(executor.map(__put_metric_data, chunks))
 
     return {
         'statusCode': 200,
         'body': 'OK'
     }
+
+def __get_values_by_timestamp(query_execution_id):
+    """ Reads every page of the results of the Athena query and returns the values of
+        each minute window, a window can appear in more than one row
+    """
+    values_by_timestamp = {}
+    paginator = athena_client.get_paginator('get_query_results')
+    pages = paginator.paginate(QueryExecutionId=query_execution_id, PaginationConfig={'PageSize': GET_QUERY_RESULTS_MAX_RESULTS})
+    is_header = True
+    for page in pages:
+        for row in page['ResultSet']['Rows']:
+            # the first row of the first page holds the column names
+            if is_header:
+                is_header = False
+                continue
+            timestamp = date_parser(row['Data'][0]['VarCharValue'])
+            values_by_timestamp.setdefault(timestamp, []).append(float(row['Data'][1]['VarCharValue']))
+    return values_by_timestamp
+
+def __get_metric_datum(timestamp, values):
+    datum = {
+        'MetricName': METRIC_NAME,
+        'Timestamp': timestamp,
+        'Unit': 'Count'
+    }
+    if len(values) == 1:
+        datum['Value'] = values[0]
+    else:
+        datum['StatisticValues'] = {
+            'SampleCount': len(values),
+            'Sum': sum(values),
+            'Minimum': min(values),
+            'Maximum': max(values)
+        }
+    return datum
+
+def __put_metric_data(metric_data):
+    client.put_metric_data(
+        Namespace=METRIC_NAMESPACE,
+        MetricData=metric_data
+    )
@@ -11,6 +11,10 @@ from botocore.exceptions import ClientError
 import logger
 import metrics_manager
 import auth_manager
+import tenant_details_cache
+import shard_manager
+import shard_paginator
+import scatter_gather
 import requests
 from aws_requests_auth.aws_auth import AWSRequestsAuth
 
@@ -22,11 +26,21 @@ region = os.environ['AWS_REGION']
 
 apigw_client = boto3.client('apigateway')
 
+# attributes of a tenant listed to the admin console, api keys and pool ids are never returned
+tenant_list_projection = 'tenantId, tenantName, tenantEmail, tenantTier, isActive'
+# segments scanned concurrently when all tenants are read, 1 scans the table sequentially
+tenant_scan_segments = int(os.environ.get('TENANT_SCAN_SEGMENTS', '4'))
+tenant_scan_timeout_seconds = int(os.environ.get('TENANT_SCAN_TIMEOUT_SECONDS', '20'))
+
 #This method has been locked down to be only
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("CreateTenantExecutionTimeMs")
 def create_tenant(event, context):
     
     api_gateway_url = ''       
-    tenant_details = json.loads(event['body'])
+    with metrics_manager.record_duration(event, "CreateTenantParseTimeMs"):
+        tenant_details = json.loads(event['body'])
 
     dynamodb = boto3.resource('dynamodb')
     table_tenant_details = dynamodb.Table('SaaSOperations-TenantDetails')#TODO: read table names from env vars
@@ -35,49 +49,80 @@ def create_tenant(event, context):
     try:          
         # for pooled tenants the apigateway url is saving in settings during stack creation
         # update from there during tenant creation
-        if(tenant_details['dedicatedTenancy'].lower()!= 'true'):
-            settings_response = table_system_settings.get_item(
-                Key={
-                    'settingName': 'apiGatewayUrl-Pooled'
-                } 
-            )
-            api_gateway_url = settings_response['Item']['settingValue']
-
-        response = table_tenant_details.put_item(
-            Item={
-                    'tenantId': tenant_details['tenantId'],
-                    'tenantName' : tenant_details['tenantName'],
-                    'tenantAddress': tenant_details['tenantAddress'],
-                    'tenantEmail': tenant_details['tenantEmail'],
-                    'tenantPhone': tenant_details['tenantPhone'],
-                    'tenantTier': tenant_details['tenantTier'],
-                    'apiKey': tenant_details['apiKey'],
-                    'userPoolId': tenant_details['userPoolId'],                 
-                    'identityPoolId': tenant_details['identityPoolId'],                 
-                    'appClientId': tenant_details['appClientId'],
-                    'dedicatedTenancy': tenant_details['dedicatedTenancy'],
-                    'isActive': True,
-                    'apiGatewayUrl': api_gateway_url
-                }
-            )                    
+        with metrics_manager.record_duration(event, "CreateTenantDalTimeMs"):
+            if(tenant_details['dedicatedTenancy'].lower()!= 'true'):
+                settings_response = table_system_settings.get_item(
+                    Key={
+                        'settingName': 'apiGatewayUrl-Pooled'
+                    } 
+                )
+                api_gateway_url = settings_response['Item']['settingValue']
+
+            response = table_tenant_details.put_item(
+                Item={
+                        'tenantId': tenant_details['tenantId'],
+                        'tenantName' : tenant_details['tenantName'],
+                        'tenantAddress': tenant_details['tenantAddress'],
+                        'tenantEmail': tenant_details['tenantEmail'],
+                        'tenantPhone': tenant_details['tenantPhone'],
+                        'tenantTier': tenant_details['tenantTier'],
+                        'shardCount': shard_manager.get_tier_shard_count(tenant_details['tenantTier']),
+                        'apiKey': tenant_details['apiKey'],
+                        'userPoolId': tenant_details['userPoolId'],                 
+                        'identityPoolId': tenant_details['identityPoolId'],                 
+                        'appClientId': tenant_details['appClientId'],
+                        'dedicatedTenancy': tenant_details['dedicatedTenancy'],
+                        'isActive': True,
+                        'apiGatewayUrl': api_gateway_url
+                    }
+                )                    
 
     except Exception as e:
         raise Exception('Error creating a new tenant', e)
     else:
         return utils.create_success_response("Tenant Created")
 
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetTenantsExecutionTimeMs")
 def get_tenants(event, context):
     
     table_tenant_details = __getTenantManagementTable(event)
 
+    pagination = utils.get_pagination_parameters(event)
+    if (pagination is not None):
+        return __get_tenants_page(event, table_tenant_details, *pagination)
+
     try:
-        response = table_tenant_details.scan()
+        # the whole table is read, as parallel segments for large numbers of tenants
+        with metrics_manager.record_duration(event, "GetTenantsDalTimeMs"):
+            tenants = scatter_gather.scan_all_segments(table_tenant_details, tenant_scan_segments, 
+                timeout_seconds=tenant_scan_timeout_seconds, ProjectionExpression=tenant_list_projection)
     except Exception as e:
         raise Exception('Error getting all tenants', e)
     else:
-        return utils.generate_response(response['Items'])   
+        with metrics_manager.record_duration(event, "GetTenantsSerializeTimeMs"):
+            return utils.generate_response(tenants)   
+
+def __get_tenants_page(event, table_tenant_details, limit, next_token):
+    try:
+        with metrics_manager.record_duration(event, "GetTenantsParseTimeMs"):
+            limit = shard_paginator.parse_limit(limit)
+        with metrics_manager.record_duration(event, "GetTenantsDalTimeMs"):
+            tenants, next_token = shard_paginator.scan_page(table_tenant_details, ['tenantId'], limit, next_token, 
+                ProjectionExpression=tenant_list_projection)
+    except ValueError:
+        return utils.create_badrequest_response("Invalid limit or nextToken")
+    except Exception as e:
+        raise Exception('Error getting a page of tenants', e)
+    else:
+        with metrics_manager.record_duration(event, "GetTenantsSerializeTimeMs"):
+            return utils.generate_response({'items': tenants, 'nextToken': next_token})
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("UpdateTenantExecutionTimeMs")
 def update_tenant(event, context):
     
     table_tenant_details = __getTenantManagementTable(event)
@@ -99,27 +144,31 @@ def update_tenant(event, context):
                 }    
             )             
 
+        shard_count = exiting_tenant_details['Item'].get('shardCount', shard_manager.LEGACY_SHARD_COUNT)
         if (exiting_tenant_details['Item']['tenantTier'].upper() != tenant_details['tenantTier'].upper()):
             # changing tenant tier
             __update_usage_plan(exiting_tenant_details['Item']['apiKey'], exiting_tenant_details['Item']['tenantTier'], tenant_details['tenantTier'])
+            shard_count = shard_manager.get_shard_count_for_tier_change(shard_count, tenant_details['tenantTier'])
 
-        response_update = table_tenant_details.update_item(
-            Key={
-                'tenantId': tenant_id,
-            },
-            UpdateExpression="set tenantName = :tenantName, tenantAddress = :tenantAddress, tenantEmail = :tenantEmail, tenantPhone = :tenantPhone, tenantTier=:tenantTier",
-            ExpressionAttributeValues={
-                    ':tenantName' : tenant_details['tenantName'],
-                    ':tenantAddress': tenant_details['tenantAddress'],
-                    ':tenantEmail': tenant_details['tenantEmail'],
-                    ':tenantPhone': tenant_details['tenantPhone'],
-                    ':tenantTier': tenant_details['tenantTier'],
+        with metrics_manager.record_duration(event, "UpdateTenantDalTimeMs"):
+            response_update = table_tenant_details.update_item(
+                Key={
+                    'tenantId': tenant_id,
                 },
-            ReturnValues="UPDATED_NEW"
-            )             
-            
+                UpdateExpression="set tenantName = :tenantName, tenantAddress = :tenantAddress, tenantEmail = :tenantEmail, tenantPhone = :tenantPhone, tenantTier=:tenantTier, shardCount=:shardCount",
+                ExpressionAttributeValues={
+                        ':tenantName' : tenant_details['tenantName'],
+                        ':tenantAddress': tenant_details['tenantAddress'],
+                        ':tenantEmail': tenant_details['tenantEmail'],
+                        ':tenantPhone': tenant_details['tenantPhone'],
+                        ':tenantTier': tenant_details['tenantTier'],
+                        ':shardCount': shard_count,
+                    },
+                ReturnValues="UPDATED_NEW"
+                )             
+        tenant_details_cache.invalidate_tenant_details(tenant_id)
         
-        logger.log_message(event, response_update)     
+        logger.log_message(event, lambda: response_update)     
 
         logger.log_message(event, "Request completed to update tenant")
         return utils.create_success_response("Tenant Updated")
@@ -128,6 +177,9 @@ def update_tenant(event, context):
         return utils.create_unauthorized_response()
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetTenantExecutionTimeMs")
 def get_tenant(event, context):
     table_tenant_details = __getTenantManagementTable(event)
     
@@ -162,6 +214,9 @@ def get_tenant(event, context):
         return utils.create_unauthorized_response()  
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("DeactivateTenantExecutionTimeMs")
 def deactivate_tenant(event, context):
     table_tenant_details = __getTenantManagementTable(event)
     
@@ -192,8 +247,9 @@ def deactivate_tenant(event, context):
                 },
             ReturnValues="ALL_NEW"
             )             
+        tenant_details_cache.invalidate_tenant_details(tenant_id)
         
-        logger.log_message(event, response)
+        logger.log_message(event, lambda: response)
 
         if (response["Attributes"]["dedicatedTenancy"].upper() == "TRUE"):
             update_details = {}
@@ -207,7 +263,7 @@ def deactivate_tenant(event, context):
         update_details['requestingTenantId'] = requesting_tenant_id
         update_details['userRole'] = user_role
         update_user_response = __invoke_disable_users(update_details, headers, auth, host, stage_name, url_disable_users)
-        logger.log_message(event, update_user_response)
+        logger.log_message(event, lambda: update_user_response)
 
         logger.log_message(event, "Request completed to deactivate tenant")
         return utils.create_success_response("Tenant Deactivated")
@@ -216,6 +272,9 @@ def deactivate_tenant(event, context):
         return utils.create_unauthorized_response()    
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("ActivateTenantExecutionTimeMs")
 def activate_tenant(event, context):
     table_tenant_details = __getTenantManagementTable(event)
     
@@ -246,8 +305,9 @@ def activate_tenant(event, context):
                 },
             ReturnValues="ALL_NEW"
             )             
+        tenant_details_cache.invalidate_tenant_details(tenant_id)
         
-        logger.log_message(event, response)
+        logger.log_message(event, lambda: response)
 
         if (response["Attributes"]["dedicatedTenancy"].upper() == "TRUE"):
             update_details = {}
@@ -261,7 +321,7 @@ def activate_tenant(event, context):
         update_details['requestingTenantId'] = requesting_tenant_id
         update_details['userRole'] = user_role
         update_user_response = __invoke_enable_users(update_details, headers, auth, host, stage_name, url_enable_users)
-        logger.log_message(event, update_user_response)
+        logger.log_message(event, lambda: update_user_response)
 
         logger.log_message(event, "Request completed to activate tenant")
         return utils.create_success_response("Tenant Activated")
@@ -269,19 +329,24 @@ def activate_tenant(event, context):
         logger.log_message(event, "Request completed as unauthorized. Only system admin can activate tenant!")        
         return utils.create_unauthorized_response()    
 
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("LoadTenantConfigExecutionTimeMs")
 def load_tenant_config(event, context):
-    params = event['pathParameters']
-    tenantName = urllib.parse.unquote(params['tenantname'])
+    with metrics_manager.record_duration(event, "LoadTenantConfigParseTimeMs"):
+        params = event['pathParameters']
+        tenantName = urllib.parse.unquote(params['tenantname'])
 
     dynamodb = boto3.resource('dynamodb')
     table_tenant_details = dynamodb.Table('SaaSOperations-TenantDetails')#TODO: read table names from env vars
     
     try:
-        response = table_tenant_details.query(
-            IndexName="SaasOperations-TenantConfig",
-            KeyConditionExpression=Key('tenantName').eq(tenantName),
-            ProjectionExpression="userPoolId, appClientId, apiGatewayUrl"
-        ) 
+        with metrics_manager.record_duration(event, "LoadTenantConfigDalTimeMs"):
+            response = table_tenant_details.query(
+                IndexName="SaasOperations-TenantConfig",
+                KeyConditionExpression=Key('tenantName').eq(tenantName),
+                ProjectionExpression="userPoolId, appClientId, apiGatewayUrl"
+            ) 
     except Exception as e:
         raise Exception('Error getting tenant config', e)
     else:
@@ -289,7 +354,8 @@ def load_tenant_config(event, context):
             return utils.create_notfound_response("Tenant not found."+
             "Please enter exact tenant name used during tenant registration.")
         else:
-            return utils.generate_response(response['Items'][0])        
+            with metrics_manager.record_duration(event, "LoadTenantConfigSerializeTimeMs"):
+                return utils.generate_response(response['Items'][0])        
 
 def __invoke_disable_users(update_details, headers, auth, host, stage_name, invoke_url):
     try:
@@ -20,6 +20,8 @@ table_tenant_stack_mapping = dynamodb.Table(tenant_stack_mapping_table_name)
 
 stack_name = 'stack-{0}'
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
 def provision_tenant(event, context):
     
     tenant_details = json.loads(event['body'])
@@ -49,6 +51,8 @@ def provision_tenant(event, context):
         return utils.create_success_response("Tenant Provisioning Started")
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
 #this method uses IAM Authorization and protected using a resource policy. This method is also invoked async
 def deprovision_tenant(event, context):
     logger.info("Request received to deprovision a tenant")
@@ -9,6 +9,10 @@ import uuid
 import logger
 import requests
 import re
+import time
+import hashlib
+import scatter_gather
+from requests.adapters import HTTPAdapter
 
 region = os.environ['AWS_REGION']
 create_tenant_admin_user_resource_path = os.environ['CREATE_TENANT_ADMIN_USER_RESOURCE_PATH']
@@ -22,84 +26,180 @@ usage_plan_basic_tier = os.environ['USAGE_PLAN_BASIC_TIER']
 
 lambda_client = boto3.client('lambda')
 apigw_client = boto3.client('apigateway')
+dynamodb = boto3.resource('dynamodb')
+table_tenant_registration = dynamodb.Table(os.environ['TENANT_REGISTRATION_TABLE_NAME'])
 
+# a registration can be resumed for this long after it started
+registration_ttl_seconds = int(os.environ.get('TENANT_REGISTRATION_TTL_SECONDS', '86400'))
+idempotency_token_max_length = 128
 
+# shared by the invocations of a container, so the SigV4 calls to the tenant management
+# services reuse their TLS connections
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=int(os.environ.get('SCATTER_GATHER_MAX_WORKERS', '10'))))
+
+
+class RegistrationConflict(Exception):
+    pass
+
+
+@logger.sample_invocation
 def register_tenant(event, context):
     logger.info(event)
     try:
-        tenant_id = uuid.uuid1().hex
         tenant_details = json.loads(event['body'])
+        idempotency_token = tenant_details.pop('idempotencyToken', None)
         tenant_details['dedicatedTenancy'] = 'false'
         if (tenant_details['tenantTier'].upper() == utils.TenantTier.PLATINUM.value.upper()):
             tenant_details['dedicatedTenancy'] = 'true'
-        
-        tenant_details['tenantId'] = tenant_id
-        tenant_details['apiKey'] = __create_api_key(tenant_details['tenantTier'], tenant_id)
 
-        logger.info(tenant_details)
+        # a request retried with the same idempotency token continues from the steps it already completed
+        registration = __get_registration(tenant_details, idempotency_token)
+        tenant_details['tenantId'] = registration['tenantId']
+        for output in registration['steps'].values():
+            tenant_details.update(output)
 
         stage_name = event['requestContext']['stage']
         host = event['headers']['Host']
         auth = utils.get_auth(host, region)
         headers = utils.get_headers(event)
-        create_user_response = __create_tenant_admin_user(tenant_details, headers, auth, host, stage_name)
-        
-        logger.info (create_user_response)
-        tenant_details['userPoolId'] = create_user_response['message']['userPoolId']
-        tenant_details['identityPoolId'] = create_user_response['message']['identityPoolId']
-        tenant_details['appClientId'] = create_user_response['message']['appClientId']
-        tenant_details['tenantAdminUserName'] = create_user_response['message']['tenantAdminUserName']
 
-        create_tenant_response = __create_tenant(tenant_details, headers, auth, host, stage_name)
-        logger.info (create_tenant_response)
-
-        if (tenant_details['dedicatedTenancy'].upper() == 'TRUE'):
-            provision_tenant_response = __provision_tenant(tenant_details, headers, auth, host, stage_name)
-            logger.info(provision_tenant_response)
+        for stage in registration_stages:
+            __run_stage(registration, stage, tenant_details, headers, auth, host, stage_name)
 
+        logger.info(lambda: tenant_details)
         
+    except RegistrationConflict as e:
+        logger.error(str(e))
+        return utils.create_conflict_response(str(e))
+    except ValueError as e:
+        logger.error('Invalid registration request: {0}'.format(e))
+        return utils.create_badrequest_response('Invalid registration request')
     except Exception as e:
         logger.error('Error registering a new tenant')
         raise Exception('Error registering a new tenant', e)
     else:
         return utils.create_success_response("You have been registered in our system")
 
+def __run_stage(registration, stage, tenant_details, headers, auth, host, stage_name):
+    """ Runs the chains of the stage concurrently, the steps of a chain one after the other.
+        Each step is checkpointed as soon as it completes and its output is added to
+        tenant_details
+    """
+    chains = [[step_name for step_name in chain if step_name not in registration['steps']] for chain in stage]
+    if (tenant_details['dedicatedTenancy'].upper() != 'TRUE'):
+        chains = [[step_name for step_name in chain if step_name != 'provisioning'] for chain in chains]
+    chains = [chain for chain in chains if len(chain) > 0]
+
+    outputs = scatter_gather.scatter_gather(
+        lambda chain, deadline: __run_chain(registration, chain, dict(tenant_details), headers, auth, host, stage_name), 
+        chains)
+    for chain, chain_outputs in zip(chains, outputs):
+        for step_name, output in zip(chain, chain_outputs):
+            registration['steps'][step_name] = output
+            tenant_details.update(output)
+
+def __run_chain(registration, chain, tenant_details, headers, auth, host, stage_name):
+    outputs = []
+    for step_name in chain:
+        output = __run_step(registration, step_name, tenant_details, headers, auth, host, stage_name)
+        tenant_details.update(output)
+        outputs.append(output)
+    return outputs
+
+def __run_step(registration, step_name, tenant_details, headers, auth, host, stage_name):
+    output = registration_steps[step_name](tenant_details, headers, auth, host, stage_name)
+    table_tenant_registration.update_item(
+        Key={'registrationId': registration['registrationId']},
+        UpdateExpression="set steps.#stepName = :output",
+        ExpressionAttributeNames={'#stepName': step_name},
+        ExpressionAttributeValues={':output': output}
+    )
+    logger.info("Registration step {0} completed for tenant {1}".format(step_name, registration['tenantId']))
+    return output
+
+def __get_registration(tenant_details, idempotency_token):
+    """ Returns the registration of the request, created with a new tenant id the first time.
+        A request with the idempotency token of an earlier one gets the registration of
+        that request, a request without a token always starts a new registration
+
+    Raises:
+        RegistrationConflict: If the token was used for another tenant name, email or tier
+    """
+    registration_key = '|'.join([tenant_details['tenantName'], tenant_details['tenantEmail'], tenant_details['tenantTier']])
+    registration = {
+        'registrationId': uuid.uuid4().hex,
+        'registrationKey': hashlib.sha256(registration_key.encode('utf-8')).hexdigest(),
+        'tenantId': uuid.uuid1().hex,
+        'steps': {},
+        'expiresAt': int(time.time()) + registration_ttl_seconds
+    }
+    if (idempotency_token is None):
+        table_tenant_registration.put_item(Item=registration)
+        return registration
+
+    if (not isinstance(idempotency_token, str) or len(idempotency_token) == 0 or len(idempotency_token) > idempotency_token_max_length):
+        raise ValueError('Invalid idempotencyToken')
+    registration['registrationId'] = hashlib.sha256(idempotency_token.encode('utf-8')).hexdigest()
+    try:
+        table_tenant_registration.put_item(Item=registration, ConditionExpression='attribute_not_exists(registrationId)')
+    except table_tenant_registration.meta.client.exceptions.ConditionalCheckFailedException:
+        existing_registration = table_tenant_registration.get_item(Key={'registrationId': registration['registrationId']}, ConsistentRead=True)['Item']
+        if (existing_registration.get('registrationKey') != registration['registrationKey']):
+            raise RegistrationConflict('The idempotencyToken was already used to register another tenant')
+        registration = existing_registration
+        logger.info(lambda: "Resuming registration of tenant {0}, completed steps: {1}".format(registration['tenantId'], list(registration['steps'])))
+    return registration
+
 def __create_tenant_admin_user(tenant_details, headers, auth, host, stage_name):
     try:
         url = ''.join(['https://', host, '/', stage_name, create_tenant_admin_user_resource_path])
         logger.info(url)
-        response = requests.post(url, data=json.dumps(tenant_details), auth=auth, headers=headers) 
-        response_json = response.json()
+        response_json = __post(url, tenant_details, headers, auth)
     except Exception as e:
         logger.error('Error occured while calling the create tenant admin user service')
         raise Exception('Error occured while calling the create tenant admin user service', e)
     else:
-        return response_json
+        logger.info (response_json)
+        return {
+            'userPoolId': response_json['message']['userPoolId'],
+            'identityPoolId': response_json['message']['identityPoolId'],
+            'appClientId': response_json['message']['appClientId'],
+            'tenantAdminUserName': response_json['message']['tenantAdminUserName']
+        }
 
 def __create_tenant(tenant_details, headers, auth, host, stage_name):
     try:
         url = ''.join(['https://', host, '/', stage_name, create_tenant_resource_path])
-        response = requests.post(url, data=json.dumps(tenant_details), auth=auth, headers=headers) 
-        response_json = response.json()
+        response_json = __post(url, tenant_details, headers, auth)
     except Exception as e:
         logger.error('Error occured while creating the tenant record in table')
         raise Exception('Error occured while creating the tenant record in table', e) 
     else:
-        return response_json
+        logger.info (response_json)
+        return {}
 
 def __provision_tenant(tenant_details, headers, auth, host, stage_name):
     try:
         url = ''.join(['https://', host, '/', stage_name, provision_tenant_resource_path])
         logger.info(url)
-        response = requests.post(url, data=json.dumps(tenant_details), auth=auth, headers=headers) 
-        response_json = response.json()['message']
+        response_json = __post(url, tenant_details, headers, auth)['message']
     except Exception as e:
         logger.error('Error occured while provisioning the tenant')
         raise Exception('Error occured while creating the tenant record in table', e) 
     else:
-        return response_json
-
-def __create_api_key(tier, tenant_id):
+        logger.info(response_json)
+        return {}
+
+def __post(url, tenant_details, headers, auth):
+    response = session.post(url, data=json.dumps(tenant_details), auth=auth, headers=headers)
+    # a step that failed must not be checkpointed as completed
+    if (int(response.status_code) != int(utils.StatusCodes.SUCCESS.value)):
+        raise Exception('Request to {0} failed with status code {1}'.format(url, response.status_code))
+    return response.json()
+
+def __create_api_key(tenant_details, headers, auth, host, stage_name):
+    tenant_id = tenant_details['tenantId']
     api_key = uuid.uuid1().hex
     response = apigw_client.create_api_key(
         name=tenant_id + '-saasOpsWorkshop',
@@ -108,8 +208,10 @@ def __create_api_key(tier, tenant_id):
         value=api_key
     )
 
-    api_key_id = response['id']
+    return {'apiKey': api_key, 'apiKeyId': response['id']}
 
+def __create_usage_plan_key(tenant_details, headers, auth, host, stage_name):
+    tier = tenant_details['tenantTier']
     usage_plan = usage_plan_basic_tier
     if tier.upper() == utils.TenantTier.PLATINUM.value.upper():
         usage_plan = usage_plan_platinum_tier
@@ -120,8 +222,27 @@ def __create_api_key(tier, tenant_id):
 
     apigw_client.create_usage_plan_key(
         usagePlanId=usage_plan,
-        keyId=api_key_id,
+        keyId=tenant_details['apiKeyId'],
         keyType='API_KEY'
     )
 
-    return api_key
+    return {}
+
+# the steps of the registration by name
+registration_steps = {
+    'apiKey': __create_api_key,
+    'tenantAdminUser': __create_tenant_admin_user,
+    'usagePlanKey': __create_usage_plan_key,
+    'tenantRecord': __create_tenant,
+    'provisioning': __provision_tenant
+}
+
+# stages run one after the other and only depend on earlier stages. The chains of steps of a
+# stage run concurrently: the api key is created and added to the usage plan of the tier
+# while the Cognito pool of the tenant admin is. The tenant record needs both, provisioning
+# starts after the tenant record exists since the tenant stack updates that record
+registration_stages = [
+    [['apiKey', 'usagePlanKey'], ['tenantAdminUser']],
+    [['tenantRecord']],
+    [['provisioning']]
+]
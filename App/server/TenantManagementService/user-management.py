@@ -5,11 +5,16 @@ import json
 import boto3
 import os
 import sys
+import time
 import logger 
 import utils
 import metrics_manager
 import auth_manager
+import scatter_gather
+import rate_limiter
+import shard_paginator
 from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
 from aws_lambda_powertools import Tracer
 tracer = Tracer()
 
@@ -20,6 +25,30 @@ iam = boto3.client('iam')
 table_tenant_user_map = dynamodb.Table('SaaSOperations-TenantUserMapping')
 table_tenant_details = dynamodb.Table('SaaSOperations-TenantDetails')
 
+# list_users returns at most 60 users per call
+cognito_list_users_max_limit = 60
+# the only attributes of a user a listing shows
+user_list_attributes = ['email', 'custom:tenantId', 'custom:userRole']
+# overall time allowed to read the users of one page from Cognito
+user_lookup_timeout_seconds = int(os.environ.get('USER_LOOKUP_TIMEOUT_SECONDS', '20'))
+# AdminGetUser falls in the UserRead quota of Cognito (120 requests per second by default),
+# shared with the other functions reading the user pools
+cognito_user_read_limiter = rate_limiter.TokenBucket(float(os.environ.get('COGNITO_USER_READ_RPS', '50')))
+user_lookup_max_attempts = int(os.environ.get('USER_LOOKUP_MAX_ATTEMPTS', '5'))
+# dedicatedTenancy per tenant id, it is set when the tenant registers and never changes
+dedicated_tenancy_cache = {}
+
+# AdminEnableUser and AdminDisableUser share the UserUpdate quota of Cognito (25 requests per
+# second by default), the limiter is shared by all the threads of the container
+cognito_user_update_limiter = rate_limiter.TokenBucket(float(os.environ.get('COGNITO_USER_UPDATE_RPS', '25')))
+cognito_throttling_error_codes = ('TooManyRequestsException', 'ThrottlingException', 'LimitExceededException')
+user_state_max_attempts = int(os.environ.get('USER_STATE_MAX_ATTEMPTS', '5'))
+user_state_base_delay_seconds = 0.1
+user_state_max_delay_seconds = 2
+# time kept to return the summary before the Lambda times out
+user_state_safety_margin_seconds = 2
+
+@logger.sample_invocation
 def create_tenant_admin_user(event, context):
     tenant_user_pool_id = os.environ['TENANT_USER_POOL_ID']
     tenant_identity_pool_id = os.environ['TENANT_IDENTITY_POOL_ID']
@@ -30,7 +59,7 @@ def create_tenant_admin_user(event, context):
     
     tenant_details = json.loads(event['body'])
     tenant_id = tenant_details['tenantId']
-    logger.info(tenant_details)
+    logger.info(lambda: tenant_details)
 
     user_mgmt = UserManagement()
 
@@ -78,6 +107,9 @@ def create_tenant_admin_user(event, context):
     return utils.create_success_response(response)
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("CreateUserExecutionTimeMs")
 #only tenant admin can create users
 def create_user(event, context):
     
@@ -98,7 +130,7 @@ def create_user(event, context):
                 'tenantId': user_tenant_id
             }
         )
-        logger.info(tenant_details)
+        logger.info(lambda: tenant_details)
         user_pool_id = tenant_details['Item']['userPoolId']    
     else:
         user_tenant_id = tenant_id
@@ -129,7 +161,7 @@ def create_user(event, context):
             ]
         )
         
-        logger.log_message(event, response)
+        logger.log_message(event, lambda: response)
         user_mgmt = UserManagement()
         user_mgmt.add_user_to_group(user_pool_id, user_details['userName'], user_tenant_id)
         response_mapping = user_mgmt.create_user_tenant_mapping(user_details['userName'], user_tenant_id)
@@ -141,11 +173,13 @@ def create_user(event, context):
         return utils.create_unauthorized_response()
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetUsersExecutionTimeMs")
 def get_users(event, context):
     tenant_id = event['requestContext']['authorizer']['tenantId']    
     user_pool_id = event['requestContext']['authorizer']['userPoolId']    
     user_role = event['requestContext']['authorizer']['userRole']  
-    users = []  
     
     
     tracer.put_annotation(key="TenantId", value=tenant_id)
@@ -153,35 +187,26 @@ def get_users(event, context):
     logger.log_message(event, "Request received to get user")
     
     if (auth_manager.isTenantAdmin(user_role) or auth_manager.isSystemAdmin(user_role)):
-        response = client.list_users(
-            UserPoolId=user_pool_id
-        )
-        logger.log_message(event, response) 
-        num_of_users = len(response['Users'])
-        metrics_manager.record_metric(event, "Numberofusers", "Count", num_of_users)
-        if (num_of_users > 0):
-            for user in response['Users']:
-                is_same_tenant_user = False
-                user_info = UserInfo()
-                for attr in user["Attributes"]:
-                    if(attr["Name"] == "custom:tenantId" and attr["Value"] == tenant_id):
-                        is_same_tenant_user = True
-                        user_info.tenant_id = attr["Value"]
-
-                    if(attr["Name"] == "custom:userRole"):
-                        user_info.user_role = attr["Value"]
-
-                    if(attr["Name"] == "email"):
-                        user_info.email = attr["Value"] 
-                if(is_same_tenant_user):
-                    user_info.enabled = user["Enabled"]
-                    user_info.created = user["UserCreateDate"]
-                    user_info.modified = user["UserLastModifiedDate"]
-                    user_info.status = user["UserStatus"] 
-                    user_info.user_name = user["Username"]
-                    users.append(user_info)                    
+        pagination = utils.get_pagination_parameters(event)
+        try:
+            with metrics_manager.record_duration(event, "GetUsersCognitoTimeMs"):
+                if (pagination is None):
+                    users = __get_all_users(tenant_id, user_pool_id, user_role)
+                else:
+                    limit = shard_paginator.parse_limit(pagination[0])
+                    users, next_token = __get_users_page(tenant_id, user_pool_id, user_role, limit, pagination[1])
+        except ValueError:
+            logger.log_message(event, "Invalid pagination parameters")
+            return utils.create_badrequest_response("Invalid limit or nextToken")
+        except scatter_gather.ScatterGatherTimeout as e:
+            logger.error("Users of the tenant could not be read in time: {0}".format(e))
+            return utils.create_service_unavailable_response("Users could not be read in time. Use limit and nextToken to read them a page at a time")
+        metrics_manager.record_metric(event, "Numberofusers", "Count", len(users))
         
-        return utils.generate_response(users)
+        with metrics_manager.record_duration(event, "GetUsersSerializeTimeMs"):
+            if (pagination is None):
+                return utils.generate_response(users)
+            return utils.generate_response({'items': users, 'nextToken': next_token})
     else:
         logger.log_message(event, "Request completed as unauthorized.")        
         return utils.create_unauthorized_response()
@@ -190,6 +215,9 @@ def get_users(event, context):
 
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("GetUserExecutionTimeMs")
 def get_user(event, context):
     requesting_user_name = event['requestContext']['authorizer']['userName']    
     tenant_id = event['requestContext']['authorizer']['tenantId']    
@@ -208,7 +236,7 @@ def get_user(event, context):
                 'tenantId': user_tenant_id
             }
         )
-        logger.info(tenant_details)
+        logger.info(lambda: tenant_details)
         user_pool_id = tenant_details['Item']['userPoolId']      
 
     if (auth_manager.isTenantUser(user_role) and user_name != requesting_user_name):        
@@ -224,6 +252,9 @@ def get_user(event, context):
             return utils.create_success_response(user_info.__dict__)
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("UpdateUserExecutionTimeMs")
 def update_user(event, context):
     requesting_user_name = event['requestContext']['authorizer']['userName']    
     tenant_id = event['requestContext']['authorizer']['tenantId']    
@@ -245,7 +276,7 @@ def update_user(event, context):
                 'tenantId': user_tenant_id
             }
         )
-        logger.info(tenant_details)
+        logger.info(lambda: tenant_details)
         user_pool_id = tenant_details['Item']['userPoolId']        
     
     if (auth_manager.isTenantUser(user_role)):                
@@ -272,11 +303,14 @@ def update_user(event, context):
                     }
                 ]
             )
-            logger.log_message(event, response)
+            logger.log_message(event, lambda: response)
             logger.log_message(event, "Request completed to update user ")
             return utils.create_success_response("user updated")    
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
+@metrics_manager.record_execution_time("DisableUserExecutionTimeMs")
 def disable_user(event, context):
     tenant_id = event['requestContext']['authorizer']['tenantId']    
     user_pool_id = event['requestContext']['authorizer']['userPoolId']    
@@ -294,7 +328,7 @@ def disable_user(event, context):
                 'tenantId': user_tenant_id
             }
         )
-        logger.info(tenant_details)
+        logger.info(lambda: tenant_details)
         user_pool_id = tenant_details['Item']['userPoolId']        
     
     if (auth_manager.isTenantAdmin(user_role) or auth_manager.isSystemAdmin(user_role)):
@@ -309,7 +343,7 @@ def disable_user(event, context):
                 UserPoolId=user_pool_id
             )
         
-            logger.log_message(event, response)
+            logger.log_message(event, lambda: response)
             logger.log_message(event, "Request completed to disable new user ")
             return utils.create_success_response("User disabled")
     else:
@@ -317,6 +351,8 @@ def disable_user(event, context):
         return utils.create_unauthorized_response()  
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
 #this method uses IAM Authorization and protected using a resource policy. This method is also invoked async
 def disable_users_by_tenant(event, context):
     logger.info("Request received to disable users by tenant")
@@ -332,24 +368,16 @@ def disable_users_by_tenant(event, context):
     
     
     if ((auth_manager.isTenantAdmin(user_role) and tenantid_to_update == requesting_tenant_id) or auth_manager.isSystemAdmin(user_role)):
-        filtering_exp = Key('tenantId').eq(tenantid_to_update)
-        response = table_tenant_user_map.query(KeyConditionExpression=filtering_exp)
-        users = response.get('Items')
-        
-        for user in users:
-            response = client.admin_disable_user(
-                Username=user['userName'],
-                UserPoolId=tenant_user_pool_id
-            )
-            
-        logger.info(response)
-        logger.info("Request completed to disable users")
-        return utils.create_success_response("Users disabled")
+        summary = __set_users_enabled(tenantid_to_update, tenant_user_pool_id, False, context)
+        logger.info("Request completed to disable users: {0} succeeded, {1} failed".format(summary['succeeded'], summary['failed']))
+        return utils.create_success_response(summary)
     else:
         logger.info("Request completed as unauthorized. Only tenant admin or system admin can update!")        
         return utils.create_unauthorized_response()
 
 @tracer.capture_lambda_handler
+@logger.sample_invocation
+@metrics_manager.flush_metrics
 #this method uses IAM Authorization and protected using a resource policy. This method is also invoked async
 def enable_users_by_tenant(event, context):
     logger.info("Request received to enable users by tenant")
@@ -365,19 +393,9 @@ def enable_users_by_tenant(event, context):
     
     
     if (auth_manager.isSystemAdmin(user_role)):
-        filtering_exp = Key('tenantId').eq(tenantid_to_update)
-        response = table_tenant_user_map.query(KeyConditionExpression=filtering_exp)
-        users = response.get('Items')
-        
-        for user in users:
-            response = client.admin_enable_user(
-                Username=user['userName'],
-                UserPoolId=tenant_user_pool_id
-            )
-            
-        logger.info(response)
-        logger.info("Request completed to enable users")
-        return utils.create_success_response("Users enables")
+        summary = __set_users_enabled(tenantid_to_update, tenant_user_pool_id, True, context)
+        logger.info("Request completed to enable users: {0} succeeded, {1} failed".format(summary['succeeded'], summary['failed']))
+        return utils.create_success_response(summary)
     else:
         logger.info("Request completed as unauthorized. Only tenant admin or system admin can update!")        
         return utils.create_unauthorized_response()
@@ -388,7 +406,7 @@ def get_user_info(event, user_pool_id, user_name):
             UserPoolId=user_pool_id,
             Username=user_name
     )
-    logger.log_message(event, response)
+    logger.log_message(event, lambda: response)
 
     user_info =  UserInfo()
     user_info.user_name = response["Username"]
@@ -402,6 +420,161 @@ def get_user_info(event, user_pool_id, user_name):
     logger.log_message(event, user_info)
     return user_info    
 
+def __set_users_enabled(tenant_id, user_pool_id, enabled, context):
+    """ Enables or disables every user of the tenant, reading the TenantUserMapping a page
+        at a time. The Cognito calls of a page run on the shared pool, within the Cognito
+        quota and until the Lambda is about to time out
+
+    Returns:
+        A summary with the number of users updated and failed, and a result per user
+    """
+    deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - user_state_safety_margin_seconds
+    results = []
+    query_arguments = {
+        'KeyConditionExpression': Key('tenantId').eq(tenant_id),
+        'ProjectionExpression': 'userName'
+    }
+    while True:
+        response = table_tenant_user_map.query(**query_arguments)
+        user_names = [mapping['userName'] for mapping in response['Items']]
+        results.extend(scatter_gather.scatter_gather(
+            lambda user_name, page_deadline: __set_user_enabled(user_pool_id, user_name, enabled, deadline), user_names))
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if (last_evaluated_key is None):
+            break
+        query_arguments['ExclusiveStartKey'] = last_evaluated_key
+
+    succeeded = len([result for result in results if result['succeeded']])
+    return {'succeeded': succeeded, 'failed': len(results) - succeeded, 'results': results}
+
+def __set_user_enabled(user_pool_id, user_name, enabled, deadline):
+    for attempt in range(user_state_max_attempts):
+        if (attempt > 0):
+            rate_limiter.backoff(attempt, user_state_base_delay_seconds, user_state_max_delay_seconds)
+        if (time.monotonic() > deadline or not cognito_user_update_limiter.acquire(deadline)):
+            return {'userName': user_name, 'succeeded': False, 'error': 'Timeout'}
+        try:
+            if (enabled):
+                client.admin_enable_user(UserPoolId=user_pool_id, Username=user_name)
+            else:
+                client.admin_disable_user(UserPoolId=user_pool_id, Username=user_name)
+        except ClientError as e:
+            error_code = e.response['Error']['Code']
+            if (error_code not in cognito_throttling_error_codes):
+                logger.error('Error updating user {0}: {1}'.format(user_name, error_code))
+                return {'userName': user_name, 'succeeded': False, 'error': error_code}
+        else:
+            return {'userName': user_name, 'succeeded': True}
+    return {'userName': user_name, 'succeeded': False, 'error': 'Throttled'}
+
+def __get_all_users(tenant_id, user_pool_id, user_role):
+    if (auth_manager.isSystemAdmin(user_role) or __is_dedicated_tenancy(tenant_id)):
+        users = []
+        next_token = None
+        while True:
+            page, next_token = __list_pool_users_page(tenant_id, user_pool_id, cognito_list_users_max_limit, next_token)
+            users.extend(page)
+            if (next_token is None):
+                return users
+
+    mappings = scatter_gather.query_all_pages(table_tenant_user_map, 
+        KeyConditionExpression=Key('tenantId').eq(tenant_id), ProjectionExpression='userName')
+    return __get_mapped_users(tenant_id, user_pool_id, [mapping['userName'] for mapping in mappings])
+
+def __get_users_page(tenant_id, user_pool_id, user_role, limit, next_token):
+    """ Returns (users, next_token) for one page of at most limit users.
+        System admins and the tenant admins of dedicated tenants page through their own
+        user pool. The tenant admins of pooled tenants page through the TenantUserMapping
+        of the tenant so the pooled user pool is never read as a whole
+    """
+    if (auth_manager.isSystemAdmin(user_role) or __is_dedicated_tenancy(tenant_id)):
+        return __list_pool_users_page(tenant_id, user_pool_id, min(limit, cognito_list_users_max_limit), next_token)
+
+    start_key = shard_paginator.decode_start_key(next_token, ['tenantId', 'userName'])
+    query_arguments = {
+        'KeyConditionExpression': Key('tenantId').eq(tenant_id),
+        'ProjectionExpression': 'userName',
+        'Limit': limit
+    }
+    if (start_key is not None):
+        if (start_key['tenantId'] != tenant_id):
+            raise shard_paginator.InvalidCursor('Invalid nextToken')
+        query_arguments['ExclusiveStartKey'] = start_key
+    response = table_tenant_user_map.query(**query_arguments)
+    users = __get_mapped_users(tenant_id, user_pool_id, [mapping['userName'] for mapping in response['Items']])
+    return users, shard_paginator.encode_start_key(response.get('LastEvaluatedKey'))
+
+def __is_dedicated_tenancy(tenant_id):
+    dedicated_tenancy = dedicated_tenancy_cache.get(tenant_id)
+    if (dedicated_tenancy is None):
+        tenant_details = table_tenant_details.get_item(
+            Key={
+                'tenantId': tenant_id
+            },
+            ProjectionExpression='dedicatedTenancy'
+        )
+        dedicated_tenancy = str(tenant_details.get('Item', {}).get('dedicatedTenancy', 'false')).lower() == 'true'
+        dedicated_tenancy_cache[tenant_id] = dedicated_tenancy
+    return dedicated_tenancy
+
+def __list_pool_users_page(tenant_id, user_pool_id, limit, next_token):
+    start_key = shard_paginator.decode_start_key(next_token, ['paginationToken'])
+    list_arguments = {
+        'UserPoolId': user_pool_id,
+        'Limit': limit,
+        'AttributesToGet': user_list_attributes
+    }
+    if (start_key is not None):
+        list_arguments['PaginationToken'] = start_key['paginationToken']
+    response = client.list_users(**list_arguments)
+
+    users = [__get_user_info_from_attributes(user, user['Attributes']) for user in response['Users']]
+    pagination_token = response.get('PaginationToken')
+    next_token = None if pagination_token is None else shard_paginator.encode_start_key({'paginationToken': pagination_token})
+    return [user_info for user_info in users if user_info.tenant_id == tenant_id], next_token
+
+def __get_mapped_users(tenant_id, user_pool_id, user_names):
+    # the users are read concurrently on the shared pool within the Cognito quota, users
+    # deleted from the pool are left out
+    users = scatter_gather.scatter_gather(lambda user_name, deadline: __get_mapped_user(tenant_id, user_pool_id, user_name, deadline), 
+        user_names, timeout_seconds=user_lookup_timeout_seconds)
+    return [user_info for user_info in users if user_info is not None]
+
+def __get_mapped_user(tenant_id, user_pool_id, user_name, deadline):
+    for attempt in range(user_lookup_max_attempts):
+        if (attempt > 0):
+            rate_limiter.backoff(attempt, user_state_base_delay_seconds, user_state_max_delay_seconds)
+        if (not cognito_user_read_limiter.acquire(deadline)):
+            raise scatter_gather.ScatterGatherTimeout('User {0} could not be read within the Cognito quota before the deadline'.format(user_name))
+        try:
+            user = client.admin_get_user(UserPoolId=user_pool_id, Username=user_name)
+            break
+        except client.exceptions.UserNotFoundException:
+            return None
+        except ClientError as e:
+            if (e.response['Error']['Code'] not in cognito_throttling_error_codes or attempt == user_lookup_max_attempts - 1):
+                raise
+    user_info = __get_user_info_from_attributes(user, user['UserAttributes'])
+    if (user_info.tenant_id != tenant_id):
+        return None
+    return user_info
+
+def __get_user_info_from_attributes(user, attributes):
+    user_info = UserInfo()
+    for attr in attributes:
+        if(attr["Name"] == "custom:tenantId"):
+            user_info.tenant_id = attr["Value"]
+        if(attr["Name"] == "custom:userRole"):
+            user_info.user_role = attr["Value"]
+        if(attr["Name"] == "email"):
+            user_info.email = attr["Value"] 
+    user_info.enabled = user["Enabled"]
+    user_info.created = user["UserCreateDate"]
+    user_info.modified = user["UserLastModifiedDate"]
+    user_info.status = user["UserStatus"] 
+    user_info.user_name = user["Username"]
+    return user_info
+
 class UserManagement:
     def create_user_pool(self, tenant_id):
         application_site_url = os.environ['TENANT_USER_POOL_CALLBACK_URL']
@@ -38,6 +38,7 @@ export class SaaSOperationsStack extends cdk.Stack {
     const lambdaPolicy = new iam.PolicyStatement({
       actions: [
         "s3:*Object",
+        "s3:AbortMultipartUpload",
         "logs:CreateLogGroup",
         "logs:PutLogEvents",
         "logs:CreateLogStream",
@@ -54,9 +55,17 @@ export class SaaSOperationsStack extends cdk.Stack {
         runtime: Runtime.PYTHON_3_9,
         code: new AssetCode(`./resources`),
         memorySize: 512,
-        timeout: Duration.seconds(10),
+        // reads every page of the tenant stack mapping table and uploads the manifest
+        timeout: Duration.minutes(5),
         environment: {
             BUCKET: artifactsBucket.bucketName,
+            // wave planning, see resources/wave_planner.py
+            WAVE_MAX_CONCURRENCY: '10',
+            WAVE_INITIAL_SIZE: '10',
+            WAVE_MAX_SIZE: '200',
+            CANARY_TENANT_IDS: '',
+            // "incremental" skips the stacks already deployed with the same commit and template, "full" deploys all
+            DEPLOY_MODE: 'incremental',
         },
         initialPolicy: [lambdaPolicy],
     })
@@ -90,6 +99,7 @@ export class SaaSOperationsStack extends cdk.Stack {
           "dynamodb:Query",
           "dynamodb:Scan",      
           "dynamodb:GetItem",        
+          "dynamodb:BatchGetItem",
         ],
         resources: [
           `arn:aws:dynamodb:${this.region}:${this.account}:table/SaaSOperations-Settings`,
@@ -217,6 +227,18 @@ export class SaaSOperationsStack extends cdk.Stack {
       timeout: Duration.seconds(10),
   })
 
+    // the iterator reads the stacks of each wave from the manifest in the output artifact
+    lambdaFunctionIterator.addToRolePolicy(
+      new iam.PolicyStatement({
+        actions: [
+          "s3:GetObject"
+        ],
+        resources: [
+          `${artifactsBucket.bucketArn}/*`,
+        ]
+      })
+    )
+
   const approvalQueue = new sqs.Queue(this, 'ApprovalQueue',{
     enforceSSL:true
   });
@@ -387,6 +409,11 @@ export class SaaSOperationsStack extends cdk.Stack {
         id: "AwsSolutions-IAM4",
         reason: "Basic execution is enough for lambda iterator"
       },
+      {
+        id: "AwsSolutions-IAM5",
+        reason: "Object level read permission is provided to the artifact bucket only.",
+        appliesTo: ["Resource::<ArtifactsBucket2AAC5544.Arn>/*"]
+      },
       {
         id: "AwsSolutions-L1",
         reason: "Python 3.9 is not on the deprecated list."
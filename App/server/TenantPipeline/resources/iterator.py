@@ -1,3 +1,8 @@
+import boto3
+import manifest
+
+s3 = boto3.client('s3')
+
 def lambda_handler(event, context):
     print(event)            
     index = event["iterator"]["index"]
@@ -8,8 +13,9 @@ def lambda_handler(event, context):
 
     iterator = {}
     iterator["index"] = index
-    iterator["step"] = index
+    iterator["step"] = step
     iterator["total_waves"] = total_waves
+    iterator["max_concurrency"] = event["iterator"]["max_concurrency"]
 
     if index < total_waves:
         iterator["continue"] = True
@@ -17,7 +23,9 @@ def lambda_handler(event, context):
         iterator["continue"] = False
 
 
+    # only the stacks of the wave to deploy are read from the manifest and passed on
     return({
         "iterator": iterator,
-        "stacks": event["stacks"],
+        "manifest": event["manifest"],
+        "stacks": manifest.read_wave(s3, event["manifest"], index),
     })
\ No newline at end of file
@@ -6,6 +6,12 @@ import json
 import zipfile
 import tempfile
 import traceback
+import time
+import random
+import hashlib
+import os
+import manifest
+import wave_planner
 
 print('Loading function')
 s3 = boto3.client('s3')
@@ -15,6 +21,15 @@ table_tenant_stack_mapping = dynamodb.Table('SaaSOperations-TenantStackMapping')
 table_tenant_details = dynamodb.Table('SaaSOperations-TenantDetails')
 table_tenant_settings = dynamodb.Table('SaaSOperations-Settings')
 
+# BatchGetItem reads at most 100 keys per call
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_MAX_ATTEMPTS = 6
+POOLED_SETTING_NAMES = ['userPoolId-pooled', 'identityPoolId-pooled', 'appClientId-pooled']
+
+# "incremental" deploys only the stacks whose recorded commit or template differ from the
+# ones being deployed, "full" deploys every stack
+DEPLOY_MODE = os.environ.get('DEPLOY_MODE', 'incremental')
+
 
 def find_artifact(artifacts, name):
     """Finds the artifact 'name' among the 'artifacts'
@@ -38,7 +53,7 @@ def get_template_url(s3, artifact, file_in_zip):
     """Gets the template artifact
     
     Downloads the artifact from the S3 artifact store to a temporary file
-    then extracts the zip and returns the file containing the CloudFormation
+    then extracts the zip and uploads the file containing the CloudFormation
     template.
     
     Args:
@@ -46,7 +61,7 @@ def get_template_url(s3, artifact, file_in_zip):
         file_in_zip: The path to the file within the zip containing the template
         
     Returns:
-        The CloudFormation template as a string
+        The URL of the uploaded CloudFormation template and the SHA-256 hash of the template
         
     Raises:
         Exception: Any exception thrown while downloading the artifact or unzipping it
@@ -64,7 +79,9 @@ def get_template_url(s3, artifact, file_in_zip):
             extracted_file = zip.extract(file_in_zip, '/tmp/')
             s3.upload_file(extracted_file, bucket, file_in_zip)
             template_url =''.join(['https://', bucket,'.s3.amazonaws.com/',file_in_zip])
-            return template_url  
+            with open(extracted_file, 'rb') as template:
+                template_hash = hashlib.sha256(template.read()).hexdigest()
+            return template_url, template_hash
 
 def put_job_success(job, message):
     """Notify CodePipeline of a successful job
@@ -133,26 +150,94 @@ def get_user_params(job_data):
 
     return decoded_parameters
 
-def get_tenant_params(tenantId):
-    """Get tenant details to be supplied to Cloud formation
+def batch_get_items(table, keys, projection_expression):
+    """Gets the items with the keys from the table with BatchGetItem, 100 keys per call
+    
     Args:
-        tenantId (str): tenantId for which details are needed
+        table: The DynamoDB table to read from
+        keys: The keys of the items
+        projection_expression: The attributes to read
     Returns:
-        params from tenant management table
+        The items found, items that do not exist are left out
+    Raises:
+        Exception: If some keys are still unprocessed after the last attempt
+    
+    """
+    items = []
+    for i in range(0, len(keys), BATCH_GET_MAX_KEYS):
+        request = {'Keys': keys[i:i + BATCH_GET_MAX_KEYS], 'ProjectionExpression': projection_expression}
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            if attempt > 0:
+                time.sleep(random.uniform(0, min(2, 0.05 * (2 ** attempt))))
+            response = dynamodb.batch_get_item(RequestItems={table.name: request})
+            items.extend(response['Responses'].get(table.name, []))
+            request = response.get('UnprocessedKeys', {}).get(table.name)
+            if request is None or len(request['Keys']) == 0:
+                break
+        else:
+            raise Exception('Could not read {0} keys from {1}'.format(len(request['Keys']), table.name))
+    return items
+
+def get_tenant_tiers(tenantIds):
+    """Gets the tier of the tenants and checks that the details their stacks are deployed 
+    with exist, for all the tenants at once
+    
+    The tenant details are read with BatchGetItem and the settings of the pooled
+    tenants are read together, instead of up to three GetItem calls per tenant.
+    
+    Args:
+        tenantIds: The tenantIds of the stack mappings, "pooled" for the pooled stack
+    Returns:
+        The tier of every tenant by tenantId, "pooled" for the pooled stack
+    Raises:
+        Exception: If the details of a tenant or a pooled setting are missing
+    
+    """
+    siloed_tenant_ids = sorted(set(tenantIds) - {'pooled'})
+    tenant_details = batch_get_items(table_tenant_details, 
+        [{'tenantId': tenantId} for tenantId in siloed_tenant_ids], 'tenantId, tenantTier, userPoolId, identityPoolId, appClientId')
+    tenant_tiers = {item['tenantId']: item.get('tenantTier', '') for item in tenant_details 
+        if 'userPoolId' in item and 'identityPoolId' in item and 'appClientId' in item}
+    for tenantId in siloed_tenant_ids:
+        if tenantId not in tenant_tiers:
+            raise Exception('Tenant details not found for tenant {0}'.format(tenantId))
+
+    if 'pooled' in tenantIds:
+        settings = batch_get_items(table_tenant_settings, 
+            [{'settingName': setting_name} for setting_name in POOLED_SETTING_NAMES], 'settingName, settingValue')
+        found_setting_names = set(item['settingName'] for item in settings)
+        for setting_name in POOLED_SETTING_NAMES:
+            if setting_name not in found_setting_names:
+                raise Exception('Setting {0} not found'.format(setting_name))
+        tenant_tiers['pooled'] = 'pooled'
+
+    return tenant_tiers
+
+def is_up_to_date(mapping, commit_id, template_hash):
+    """Checks if the stack of the mapping was last deployed with the commit and template
+    
+    The state machine records the commit and template hash of a stack once its
+    deployment succeeds, stacks that failed or were never deployed are out of date.
+    
+    Args:
+        mapping: The tenant stack mapping
+        commit_id: The commit being deployed
+        template_hash: The hash of the template being deployed
+    Returns:
+        True if the deployment of the stack can be skipped
+    
     """
-    if (tenantId != "pooled"):
-        tenant_details = table_tenant_details.get_item(Key={'tenantId': tenantId})   
-        userPoolId = tenant_details['Item']['userPoolId']   
-        identityPoolId = tenant_details['Item']['identityPoolId']
-        appClientId = tenant_details['Item']['appClientId']
-    else:
-        tenant_details = table_tenant_settings.get_item(Key={'settingName': 'userPoolId-pooled'})                        
-        userPoolId = tenant_details['Item']['settingValue']
-        tenant_details = table_tenant_settings.get_item(Key={'settingName': 'identityPoolId-pooled'})                        
-        identityPoolId = tenant_details['Item']['settingValue']
-        tenant_details = table_tenant_settings.get_item(Key={'settingName': 'appClientId-pooled'})                        
-        appClientId = tenant_details['Item']['settingValue']
+    if DEPLOY_MODE != 'incremental':
+        return False
+    return mapping.get('codeCommitId') == commit_id and mapping.get('templateHash') == template_hash
 
+def get_tenant_params(tenantId):
+    """Get the parameters of the tenant stack to be supplied to Cloud formation
+    Args:
+        tenantId (str): tenantId of the stack
+    Returns:
+        The CloudFormation parameters of the stack, the TenantIdParameter
+    """
     params = []
     param_tenantid = {}
     param_tenantid['ParameterKey'] = 'TenantIdParameter'
@@ -167,6 +252,22 @@ def add_parameter(params, parameter_key, parameter_value):
     parameter['ParameterValue'] = parameter_value
     params.append(parameter)
 
+def get_stack_mappings():
+    """Yields the pages of the tenant stack mapping table
+    
+    Returns:
+        A generator of lists of mappings, one list per page of the scan
+    
+    """
+    scan_arguments = {}
+    while True:
+        response = table_tenant_stack_mapping.scan(**scan_arguments)
+        yield response['Items']
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if last_evaluated_key is None:
+            return
+        scan_arguments['ExclusiveStartKey'] = last_evaluated_key
+
 def lambda_handler(event, context):
     """The Lambda function handler
     Args:
@@ -174,7 +275,8 @@ def lambda_handler(event, context):
         context: The context passed by Lambda
         
     """
-    stacks = []
+    manifest_writer = None
+    wave_plan = None
     try:
         # Extract the Job ID
         job_id = event['CodePipeline.job']['id']
@@ -193,11 +295,6 @@ def lambda_handler(event, context):
         input_artifacts = job_data['inputArtifacts']
         output_artifact = job_data['outputArtifacts'][0]
         print(output_artifact)
-
-
-        # Get all the stacks for each tenant to be updated/created from tenant stack mapping table
-        mappings = table_tenant_stack_mapping.scan()
-        print (mappings)
         print (input_artifacts)
 
         output_bucket = output_artifact['location']['s3Location']['bucketName']
@@ -205,55 +302,69 @@ def lambda_handler(event, context):
         print (output_key)
         print (output_bucket)
 
-        #Create array to pass to step function
-        for mapping in mappings['Items']:
-            stack = mapping['stackName']
-            tenantId = mapping['tenantId']
-            waveNumber = mapping['waveNumber']
-
-            # Get the parameters to be passed to the Cloudformation from tenant table
-            params = get_tenant_params(tenantId)
+        # Get the artifact details and the JSON template file out of the artifact, 
+        # the same template is used for every stack
+        artifact_data = find_artifact(input_artifacts, artifact)
+        template_url, template_hash = get_template_url(s3, artifact_data, template_file)
+        print(template_hash)
+
+        # The stacks are streamed to the output artifact grouped by wave, only output.json 
+        # with the location of the manifest is passed to the step function
+        manifest_writer = manifest.ManifestWriter(s3, output_bucket, output_key)
+
+        # Get all the stacks for each tenant to be updated/created from tenant stack mapping table, a page at a time.
+        # The waves are planned from the tiers and canary tenants as the pages are read, the waveNumber of the 
+        # mappings is not used. The planner spills the mappings to /tmp grouped by canary and tier
+        wave_plan = wave_planner.WavePlanner()
+        skipped_count = 0
+        for page in get_stack_mappings():
+            outdated_mappings = [mapping for mapping in page if not is_up_to_date(mapping, commit_id, template_hash)]
+            skipped_count += len(page) - len(outdated_mappings)
+            # Get the tier of all the tenants of the page to deploy at once
+            tenant_tiers = get_tenant_tiers([mapping['tenantId'] for mapping in outdated_mappings])
+            for mapping in outdated_mappings:
+                wave_plan.add({'tenantId': mapping['tenantId'], 'stackName': mapping['stackName'], 'tenantTier': tenant_tiers[mapping['tenantId']]})
+        print('{0} stacks to deploy, {1} stacks already up to date'.format(wave_plan.get_stack_count(), skipped_count))
+
+        # The stacks are written to the manifest wave by wave
+        for waveNumber, mapping in wave_plan.waves():
+            # Get the parameters to be passed to the Cloudformation
+            params = get_tenant_params(mapping['tenantId'])
             # Passing parameter to enable canary deployment for lambda's
             add_parameter(params, 'LambdaCanaryDeploymentPreference', "True")
 
-            # Get the artifact details
-            artifact_data = find_artifact(input_artifacts, artifact)
-
-            # Get the JSON template file out of the artifact
-            template_url = get_template_url(s3, artifact_data, template_file)
-
-            stacks.append(
+            manifest_writer.add(
                 {
-                    "stackName": stack,
-                    "tenantId": tenantId,
+                    "stackName": mapping['stackName'],
+                    "tenantId": mapping['tenantId'],
                     "templateURL": template_url,
                     "parameters": params,
                     "commitId": commit_id,
-                    "waveNumber": int(waveNumber)
+                    "templateHash": template_hash,
+                    "waveNumber": waveNumber
                 })
 
+        execution_input = manifest_writer.close({
+            'total_waves': wave_plan.get_total_waves(),
+            'max_concurrency': wave_planner.max_wave_concurrency
+        })
+        print(execution_input)
+        print('output.json.zip uploaded to s3')
+
     except Exception as e:
         # If any other exceptions which we didn't expect are raised
         # then fail the job and log the exception message.
         print('Function failed due to exception.') 
         print(e)
         traceback.print_exc()
+        if manifest_writer is not None:
+            manifest_writer.abort()
         put_job_failure(job_id, 'Function exception: ' + str(e))
-
-    print (stacks)
-
-    #write stacks variable to file
-    with open('/tmp/output.json', 'w') as outfile:
-        json.dump({"stacks": stacks}, outfile)
-
-    #zip the file
-    with zipfile.ZipFile('/tmp/output.json.zip', 'w') as zip:
-        zip.write('/tmp/output.json', 'output.json')
-
-    #upload the output to output_bucket in s3
-    s3.upload_file('/tmp/output.json.zip', output_bucket, output_key)
-    print('output.json.zip uploaded to s3')
+        return None
+    finally:
+        if wave_plan is not None:
+            wave_plan.close()
 
     put_job_success(job_id, "Function complete.")
     print('Function complete.')       
-    return stacks
\ No newline at end of file
+    return execution_input
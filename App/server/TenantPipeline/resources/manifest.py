@@ -0,0 +1,138 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import io
+import json
+import zipfile
+
+# S3 parts must be at least 5 MB, except the last one
+MULTIPART_PART_SIZE = 8 * 1024 * 1024
+# stacks written per zip entry of a wave
+WAVE_PART_STACK_COUNT = 500
+EXECUTION_INPUT_FILE = 'output.json'
+
+
+class S3MultipartWriter:
+    """Write-only, non seekable file that uploads what is written to s3://bucket/key
+    through a multipart upload, holding at most one part in memory.
+
+    close() completes the upload, abort() discards it.
+    """
+
+    def __init__(self, s3, bucket, key):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self._buffer = bytearray()
+        self._position = 0
+        self._parts = []
+        self._upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)['UploadId']
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self._position += len(data)
+        if len(self._buffer) >= MULTIPART_PART_SIZE:
+            self._upload_part()
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def seekable(self):
+        return False
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._upload_id is None:
+            return
+        if len(self._buffer) > 0 or len(self._parts) == 0:
+            self._upload_part()
+        self.s3.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            MultipartUpload={'Parts': self._parts})
+        self._upload_id = None
+
+    def abort(self):
+        if self._upload_id is None:
+            return
+        self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id)
+        self._upload_id = None
+
+    def _upload_part(self):
+        part_number = len(self._parts) + 1
+        response = self.s3.upload_part(Bucket=self.bucket, Key=self.key, UploadId=self._upload_id,
+            PartNumber=part_number, Body=bytes(self._buffer))
+        self._parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+        self._buffer = bytearray()
+
+
+class ManifestWriter:
+    """Streams the stacks of a deployment into a zip uploaded to s3://bucket/key.
+
+    The stacks of each wave are written as entries waves/<waveNumber>/<part>.json of at
+    most WAVE_PART_STACK_COUNT stacks, so memory only holds one part per wave. close()
+    adds output.json, the input of the deployment state machine, which holds the
+    location of the manifest and the stack count of each wave instead of the stacks.
+    """
+
+    def __init__(self, s3, bucket, key):
+        self.location = {'bucket': bucket, 'key': key}
+        self._writer = S3MultipartWriter(s3, bucket, key)
+        self._zip = zipfile.ZipFile(self._writer, 'w', compression=zipfile.ZIP_DEFLATED)
+        self._waves = {}
+        self._pending = {}
+
+    def add(self, stack):
+        wave_number = stack['waveNumber']
+        pending = self._pending.setdefault(wave_number, [])
+        pending.append(stack)
+        if len(pending) == WAVE_PART_STACK_COUNT:
+            self._write_part(wave_number)
+
+    def close(self, execution_input=None):
+        """Writes the remaining stacks and output.json and completes the upload
+
+        Args:
+            execution_input: Other values to add to output.json
+        Returns:
+            The content of output.json
+        """
+        for wave_number in list(self._pending):
+            self._write_part(wave_number)
+
+        execution_input = dict(execution_input or {})
+        execution_input['manifest'] = self.location
+        execution_input['waves'] = [{'waveNumber': wave_number, 'stackCount': wave['stackCount'], 'parts': wave['parts']}
+            for wave_number, wave in sorted(self._waves.items())]
+        self._zip.writestr(EXECUTION_INPUT_FILE, json.dumps(execution_input))
+        self._zip.close()
+        self._writer.close()
+        return execution_input
+
+    def abort(self):
+        self._writer.abort()
+
+    def _write_part(self, wave_number):
+        stacks = self._pending.pop(wave_number)
+        if len(stacks) == 0:
+            return
+        wave = self._waves.setdefault(wave_number, {'stackCount': 0, 'parts': 0})
+        self._zip.writestr(get_part_name(wave_number, wave['parts']), json.dumps(stacks))
+        wave['stackCount'] += len(stacks)
+        wave['parts'] += 1
+
+
+def get_part_name(wave_number, part):
+    return 'waves/{0}/{1:05d}.json'.format(wave_number, part)
+
+
+def read_wave(s3, location, wave_number):
+    """Returns the stacks of the wave from the manifest at location, [] if the wave has none"""
+    response = s3.get_object(Bucket=location['bucket'], Key=location['key'])
+    with zipfile.ZipFile(io.BytesIO(response['Body'].read())) as manifest:
+        prefix = 'waves/{0}/'.format(wave_number)
+        stacks = []
+        for name in sorted(name for name in manifest.namelist() if name.startswith(prefix)):
+            stacks.extend(json.loads(manifest.read(name)))
+        return stacks
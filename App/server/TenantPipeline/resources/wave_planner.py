@@ -0,0 +1,112 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import os
+import tempfile
+
+POOLED_TENANT_ID = 'pooled'
+
+# siloed stacks are deployed from the lowest tier up, so issues surface before they reach
+# the largest tenants. The pooled stack serves every pooled tenant and is deployed last
+TIER_ORDER = ['basic', 'standard', 'premium', 'platinum']
+CANARY_RANK = -1
+
+# stacks deployed at the same time within a wave, keeps CreateStack/UpdateStack calls
+# within the CloudFormation API limits
+max_wave_concurrency = int(os.environ.get('WAVE_MAX_CONCURRENCY', '10'))
+# the first wave after the canaries has initial_wave_size stacks, every wave after it twice
+# as many up to max_wave_size, so the number of waves grows with the log of the fleet size
+initial_wave_size = int(os.environ.get('WAVE_INITIAL_SIZE', '10'))
+max_wave_size = int(os.environ.get('WAVE_MAX_SIZE', '200'))
+# tenants deployed first, in waves of their own
+canary_tenant_ids = [tenant_id.strip() for tenant_id in os.environ.get('CANARY_TENANT_IDS', '').split(',') if tenant_id.strip() != '']
+
+
+class WavePlanner:
+    """Splits the stack mappings into deployment waves as they are added.
+
+    Canary tenants come first, in waves of at most max_wave_size. The other stacks follow
+    ordered by tier, in waves that start at initial_wave_size and double up to max_wave_size.
+
+    The mappings are grouped by canary and tier as they are added and each group is
+    spilled to a temporary file, so memory does not grow with the number of tenants.
+    Once all the mappings are added, waves() reads the groups back in deployment order.
+    close() deletes the temporary files.
+    """
+
+    def __init__(self, canary_tenant_ids=canary_tenant_ids, initial_wave_size=initial_wave_size, max_wave_size=max_wave_size):
+        self.canary_tenant_ids = set(canary_tenant_ids)
+        self.initial_wave_size = max(1, min(initial_wave_size, max_wave_size))
+        self.max_wave_size = max_wave_size
+        self._groups = {}
+
+    def add(self, mapping):
+        """Adds a stack mapping, with the tenantId and the tenantTier"""
+        rank = self._get_rank(mapping)
+        group = self._groups.get(rank)
+        if group is None:
+            group = {'file': tempfile.TemporaryFile('w+'), 'stackCount': 0}
+            self._groups[rank] = group
+        group['file'].write(json.dumps(mapping) + '\n')
+        group['stackCount'] += 1
+
+    def get_stack_count(self):
+        return sum(group['stackCount'] for group in self._groups.values())
+
+    def get_total_waves(self):
+        canary_count = self._get_stack_count(CANARY_RANK)
+        total_waves = -(-canary_count // self.max_wave_size)
+        remaining = self.get_stack_count() - canary_count
+        wave_size = self.initial_wave_size
+        while remaining > 0:
+            total_waves += 1
+            remaining -= wave_size
+            wave_size = min(wave_size * 2, self.max_wave_size)
+        return total_waves
+
+    def waves(self):
+        """Yields (waveNumber, mapping) for every mapping in deployment order, waveNumber starts at 1"""
+        wave_number = 0
+        for index, mapping in enumerate(self._read_group(CANARY_RANK)):
+            if index % self.max_wave_size == 0:
+                wave_number += 1
+            yield wave_number, mapping
+
+        wave_size = None
+        remaining_in_wave = 0
+        for rank in sorted(rank for rank in self._groups if rank != CANARY_RANK):
+            for mapping in self._read_group(rank):
+                if remaining_in_wave == 0:
+                    wave_number += 1
+                    wave_size = self.initial_wave_size if wave_size is None else min(wave_size * 2, self.max_wave_size)
+                    remaining_in_wave = wave_size
+                remaining_in_wave -= 1
+                yield wave_number, mapping
+
+    def close(self):
+        for group in self._groups.values():
+            group['file'].close()
+        self._groups = {}
+
+    def _get_stack_count(self, rank):
+        group = self._groups.get(rank)
+        return 0 if group is None else group['stackCount']
+
+    def _read_group(self, rank):
+        group = self._groups.get(rank)
+        if group is None:
+            return
+        group['file'].seek(0)
+        for line in group['file']:
+            yield json.loads(line)
+
+    def _get_rank(self, mapping):
+        if mapping['tenantId'] in self.canary_tenant_ids:
+            return CANARY_RANK
+        if mapping['tenantId'] == POOLED_TENANT_ID:
+            return len(TIER_ORDER) + 1
+        tier = str(mapping.get('tenantTier', '')).lower()
+        if tier in TIER_ORDER:
+            return TIER_ORDER.index(tier)
+        return len(TIER_ORDER)
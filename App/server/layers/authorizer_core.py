@@ -0,0 +1,237 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import re
+import time
+import copy
+import functools
+import logger
+import jwt_verifier
+from jwks_cache import JwksCache
+
+region = os.environ['AWS_REGION']
+
+# RS256 signature verification backend, selected with JWT_VERIFIER_BACKEND (jose or cryptography)
+verifier_backend = jwt_verifier.get_backend()
+
+# signing keys of the user pools, kept across invocations of a warm container
+jwks_cache = JwksCache(region, key_builder=verifier_backend.construct_key)
+
+PATH_REGEX = r"^[/.a-zA-Z0-9-\*]+$"
+path_pattern = re.compile(PATH_REGEX)
+
+
+@functools.lru_cache(maxsize=256)
+def get_arn_prefix(region, aws_account_id, rest_api_id, stage):
+    """Returns the execute-api ARN prefix of an API stage, built once per (region, account, api, stage)"""
+    return "arn:aws:execute-api:" + region + ":" + aws_account_id + ":" + rest_api_id + "/" + stage + "/"
+
+
+@functools.lru_cache(maxsize=256)
+def get_allow_all_policy_document(version, region, aws_account_id, rest_api_id, stage):
+    """Returns the policy document that allows all methods of an API stage, built once per stage.
+    Callers get a copy through AuthPolicy.build()."""
+    return {
+        'Version' : version,
+        'Statement' : [
+            {
+                'Action': 'execute-api:Invoke',
+                'Effect': 'Allow',
+                'Resource': [get_arn_prefix(region, aws_account_id, rest_api_id, stage) + HttpVerb.ALL + "/*"]
+            }
+        ]
+    }
+
+
+def validateJWT(token, app_client_id, user_pool_id):
+    # the token can be passed already decoded (see jwt_verifier.decode_token),
+    # so that it is only base64 decoded and parsed once per request
+    if not isinstance(token, jwt_verifier.DecodedToken):
+        token = jwt_verifier.decode_token(token)
+    # get the kid from the headers prior to verification
+    kid = token.header.get('kid')
+    # look up the public key for the kid in the keys of the user pool
+    public_key = jwks_cache.get_key(user_pool_id, kid)
+    if public_key is None:
+        logger.info('Public key not found in jwks.json')
+        return False
+    # verify the signature of the message (the first two sections of the token)
+    if not jwt_verifier.verify_signature(verifier_backend, public_key, token):
+        logger.info('Signature verification failed')
+        return False
+    logger.info('Signature successfully verified')
+    # since we passed the verification, we can now safely
+    # use the unverified claims
+    claims = token.claims
+    # additionally we can verify the token expiration
+    if time.time() > claims['exp']:
+        logger.info('Token is expired')
+        return False
+    # and the Audience  (use claims['client_id'] if verifying an access token)
+    if claims['aud'] != app_client_id:
+        logger.info('Token was not issued for this audience')
+        return False
+    # now we can use the claims
+    logger.info(claims)
+    return claims
+
+
+class HttpVerb:
+    GET     = "GET"
+    POST    = "POST"
+    PUT     = "PUT"
+    PATCH   = "PATCH"
+    HEAD    = "HEAD"
+    DELETE  = "DELETE"
+    OPTIONS = "OPTIONS"
+    ALL     = "*"
+
+class AuthPolicy(object):
+    awsAccountId = ""
+    """The AWS account id the policy will be generated for. This is used to create the method ARNs."""
+    principalId = ""
+    """The principal used for the policy, this should be a unique identifier for the end user."""
+    version = "2012-10-17"
+    """The policy version used for the evaluation. This should always be '2012-10-17'"""
+    pathRegex = PATH_REGEX
+    """The regular expression used to validate resource paths for the policy"""
+
+    """these are the internal lists of allowed and denied methods. These are lists
+    of objects and each object has 2 properties: A resource ARN and a nullable
+    conditions statement.
+    the build method processes these lists and generates the approriate
+    statements for the final policy"""
+    allowMethods = []
+    denyMethods = []
+
+    restApiId = "*"
+    """The API Gateway API id. By default this is set to '*'"""
+    region = "*"
+    """The region where the API is deployed. By default this is set to '*'"""
+    stage = "*"
+    """The name of the stage used in the policy. By default this is set to '*'"""
+
+    def __init__(self, principal, awsAccountId):
+        self.awsAccountId = awsAccountId
+        self.principalId = principal
+        self.allowMethods = []
+        self.denyMethods = []
+        self._allowsAllMethods = False
+
+    def _addMethod(self, effect, verb, resource, conditions):
+        """Adds a method to the internal lists of allowed or denied methods. Each object in
+        the internal list contains a resource ARN and a condition statement. The condition
+        statement can be null."""
+        if verb != "*" and not hasattr(HttpVerb, verb):
+            raise NameError("Invalid HTTP verb " + verb + ". Allowed verbs in HttpVerb class")
+        if not path_pattern.match(resource):
+            raise NameError("Invalid resource path: " + resource + ". Path should match " + self.pathRegex)
+
+        if resource[:1] == "/":
+            resource = resource[1:]
+
+        resourceArn = get_arn_prefix(self.region, self.awsAccountId, self.restApiId, self.stage) + verb + "/" + resource
+
+        if effect.lower() == "allow":
+            self.allowMethods.append({
+                'resourceArn' : resourceArn,
+                'conditions' : conditions
+            })
+        elif effect.lower() == "deny":
+            self.denyMethods.append({
+                'resourceArn' : resourceArn,
+                'conditions' : conditions
+            })
+
+    def _getEmptyStatement(self, effect):
+        """Returns an empty statement object prepopulated with the correct action and the
+        desired effect."""
+        statement = {
+            'Action': 'execute-api:Invoke',
+            'Effect': effect[:1].upper() + effect[1:].lower(),
+            'Resource': []
+        }
+
+        return statement
+
+    def _getStatementForEffect(self, effect, methods):
+        """This function loops over an array of objects containing a resourceArn and
+        conditions statement and generates the array of statements for the policy."""
+        statements = []
+
+        if len(methods) > 0:
+            statement = self._getEmptyStatement(effect)
+
+            for curMethod in methods:
+                if curMethod['conditions'] is None or len(curMethod['conditions']) == 0:
+                    statement['Resource'].append(curMethod['resourceArn'])
+                else:
+                    conditionalStatement = self._getEmptyStatement(effect)
+                    conditionalStatement['Resource'].append(curMethod['resourceArn'])
+                    conditionalStatement['Condition'] = curMethod['conditions']
+                    statements.append(conditionalStatement)
+
+            statements.append(statement)
+
+        return statements
+
+    def allowAllMethods(self):
+        """Adds a '*' allow to the policy to authorize access to all methods of an API"""
+        self._addMethod("Allow", HttpVerb.ALL, "*", [])
+        self._allowsAllMethods = True
+
+    def denyAllMethods(self):
+        """Adds a '*' allow to the policy to deny access to all methods of an API"""
+        self._addMethod("Deny", HttpVerb.ALL, "*", [])
+
+    def allowMethod(self, verb, resource):
+        """Adds an API Gateway method (Http verb + Resource path) to the list of allowed
+        methods for the policy"""
+        self._addMethod("Allow", verb, resource, [])
+
+    def denyMethod(self, verb, resource):
+        """Adds an API Gateway method (Http verb + Resource path) to the list of denied
+        methods for the policy"""
+        self._addMethod("Deny", verb, resource, [])
+
+    def allowMethodWithConditions(self, verb, resource, conditions):
+        """Adds an API Gateway method (Http verb + Resource path) to the list of allowed
+        methods and includes a condition for the policy statement. More on AWS policy
+        conditions here: http://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_elements.html#Condition"""
+        self._addMethod("Allow", verb, resource, conditions)
+
+    def denyMethodWithConditions(self, verb, resource, conditions):
+        """Adds an API Gateway method (Http verb + Resource path) to the list of denied
+        methods and includes a condition for the policy statement. More on AWS policy
+        conditions here: http://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_elements.html#Condition"""
+        self._addMethod("Deny", verb, resource, conditions)
+
+    def build(self):
+        """Generates the policy document based on the internal lists of allowed and denied
+        conditions. This will generate a policy with two main statements for the effect:
+        one statement for Allow and one statement for Deny.
+        Methods that includes conditions will have their own statement in the policy."""
+        if ((self.allowMethods is None or len(self.allowMethods) == 0) and
+            (self.denyMethods is None or len(self.denyMethods) == 0)):
+            raise NameError("No statements defined for the policy")
+
+        if (self._allowsAllMethods and len(self.allowMethods) == 1 and len(self.denyMethods) == 0):
+            # the common case only depends on the API stage, copy its memoized document
+            return {
+                'principalId' : self.principalId,
+                'policyDocument' : copy.deepcopy(get_allow_all_policy_document(self.version, self.region, self.awsAccountId, self.restApiId, self.stage))
+            }
+
+        policy = {
+            'principalId' : self.principalId,
+            'policyDocument' : {
+                'Version' : self.version,
+                'Statement' : []
+            }
+        }
+
+        policy['policyDocument']['Statement'].extend(self._getStatementForEffect("Allow", self.allowMethods))
+        policy['policyDocument']['Statement'].extend(self._getStatementForEffect("Deny", self.denyMethods))
+
+        return policy
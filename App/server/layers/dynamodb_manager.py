@@ -0,0 +1,140 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import random
+import threading
+import time
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import logger
+import scatter_gather
+from cache_manager import LruTtlCache
+
+# request size limits of BatchWriteItem and BatchGetItem
+BATCH_WRITE_MAX_ITEMS = 25
+BATCH_GET_MAX_KEYS = 100
+
+# attempts per batch call before unprocessed items or keys are reported as failed
+batch_max_attempts = int(os.environ.get('DYNAMODB_BATCH_MAX_ATTEMPTS', '6'))
+batch_base_delay_seconds = 0.05
+batch_max_delay_seconds = 2
+
+# one botocore config shared by every cached resource: a connection pool large enough
+# for the partition fan-out of the DALs, with TCP keep-alive on the pooled connections
+botocore_config = Config(
+    max_pool_connections=int(os.environ.get('DYNAMODB_MAX_POOL_CONNECTIONS', '20')),
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=5,
+    retries={'max_attempts': 3, 'mode': 'standard'}
+)
+
+# a single session, so service models are loaded once per container
+session = boto3.session.Session()
+session_lock = threading.Lock()
+
+# Table objects per (access key id, table name). The STS credentials passed by the
+# authorizer are valid for an hour, entries are dropped before that.
+table_cache = LruTtlCache(
+    max_size=int(os.environ.get('DYNAMODB_TABLE_CACHE_MAX_SIZE', '64')),
+    ttl_seconds=int(os.environ.get('DYNAMODB_TABLE_CACHE_TTL_SECONDS', '3000'))
+)
+
+
+def get_table(event, table_name):
+    """Returns a DynamoDB Table for table_name that uses the STS credentials of the caller,
+    passed by the authorizer in the request context.
+
+    The Table (and the connection pool of its client) is reused by later requests made
+    with the same credentials in this container.
+    """
+    accesskey = event['requestContext']['authorizer']['accesskey']
+    cache_key = (accesskey, table_name)
+
+    table = table_cache.get(cache_key, None)
+    if table is None:
+        secretkey = event['requestContext']['authorizer']['secretkey']
+        sessiontoken = event['requestContext']['authorizer']['sessiontoken']
+        # creating resources from a shared session is not thread safe
+        with session_lock:
+            dynamodb = session.resource('dynamodb',
+                aws_access_key_id=accesskey,
+                aws_secret_access_key=secretkey,
+                aws_session_token=sessiontoken,
+                config=botocore_config
+            )
+        table = dynamodb.Table(table_name)
+        table_cache.put(cache_key, table)
+    return table
+
+
+def batch_write_items(table, items):
+    """Puts the items with BatchWriteItem, 25 per call with the calls running concurrently.
+    UnprocessedItems are retried with exponential backoff and full jitter.
+
+    Returns:
+        A list with, for every item that could not be written, {'item': item, 'error': reason}
+    """
+    chunks = [items[i:i + BATCH_WRITE_MAX_ITEMS] for i in range(0, len(items), BATCH_WRITE_MAX_ITEMS)]
+    failures = scatter_gather.scatter_gather(lambda chunk, deadline: __batch_write_chunk(table, chunk), chunks)
+    return [failure for chunk_failures in failures for failure in chunk_failures]
+
+
+def batch_get_items(table, keys, projection_expression=None):
+    """Gets the items with the keys with BatchGetItem, 100 keys per call with the calls running
+    concurrently. UnprocessedKeys are retried with exponential backoff and full jitter.
+
+    Returns:
+        (items, failures) where failures lists {'key': key, 'error': reason} for every key
+        that could not be read. Keys of items that do not exist are in neither.
+    """
+    chunks = [keys[i:i + BATCH_GET_MAX_KEYS] for i in range(0, len(keys), BATCH_GET_MAX_KEYS)]
+    results = scatter_gather.scatter_gather(lambda chunk, deadline: __batch_get_chunk(table, chunk, projection_expression), chunks)
+    items = [item for chunk_items, chunk_failures in results for item in chunk_items]
+    failures = [failure for chunk_items, chunk_failures in results for failure in chunk_failures]
+    return items, failures
+
+
+def __batch_write_chunk(table, chunk):
+    requests = [{'PutRequest': {'Item': item}} for item in chunk]
+    for attempt in range(batch_max_attempts):
+        if attempt > 0:
+            __backoff(attempt)
+        try:
+            response = table.meta.client.batch_write_item(RequestItems={table.name: requests})
+        except ClientError as e:
+            logger.error('Error writing a batch of {0} items: {1}'.format(len(requests), e))
+            return [{'item': request['PutRequest']['Item'], 'error': e.response['Error']['Code']} for request in requests]
+        requests = response.get('UnprocessedItems', {}).get(table.name, [])
+        if len(requests) == 0:
+            return []
+    return [{'item': request['PutRequest']['Item'], 'error': 'Unprocessed'} for request in requests]
+
+
+def __batch_get_chunk(table, chunk, projection_expression):
+    request = {'Keys': chunk}
+    if projection_expression is not None:
+        request['ProjectionExpression'] = projection_expression
+    items = []
+    for attempt in range(batch_max_attempts):
+        if attempt > 0:
+            __backoff(attempt)
+        try:
+            response = table.meta.client.batch_get_item(RequestItems={table.name: request})
+        except ClientError as e:
+            logger.error('Error reading a batch of {0} keys: {1}'.format(len(request['Keys']), e))
+            return items, [{'key': key, 'error': e.response['Error']['Code']} for key in request['Keys']]
+        items.extend(response['Responses'].get(table.name, []))
+        unprocessed = response.get('UnprocessedKeys', {}).get(table.name)
+        if unprocessed is None or len(unprocessed['Keys']) == 0:
+            return items, []
+        request = unprocessed
+    return items, [{'key': key, 'error': 'Unprocessed'} for key in request['Keys']]
+
+
+def __backoff(attempt):
+    time.sleep(random.uniform(0, min(batch_max_delay_seconds, batch_base_delay_seconds * (2 ** attempt))))
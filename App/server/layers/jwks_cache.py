@@ -0,0 +1,136 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+import threading
+import time
+import urllib.request
+
+from jose import jwk
+
+import logger
+
+JWKS_URL_FORMAT = 'https://cognito-idp.{}.amazonaws.com/{}/.well-known/jwks.json'
+
+
+class JwksEntry:
+    def __init__(self, keys, fetched_at, expires_at):
+        self.keys = keys
+        self.fetched_at = fetched_at
+        self.expires_at = expires_at
+
+
+class JwksCache:
+    """Caches the signing keys of Cognito user pools for the lifetime of a warm container.
+
+    Keys are stored per user pool id as public key objects (built with key_builder)
+    indexed by kid, so a token can be verified without downloading jwks.json or
+    rebuilding the key. Entries expire after ttl_seconds, an unknown kid triggers a
+    refresh (at most once every min_refresh_interval_seconds per pool) and only one
+    refresh per pool runs at a time. When a refresh fails the cached keys are kept for
+    another retry_after_seconds, so an outage does not cost an HTTPS call per request.
+    At most max_pools pools are cached, the least recently fetched one is evicted
+    together with its refresh lock.
+    """
+
+    def __init__(self, region, key_builder=jwk.construct, ttl_seconds=3600, min_refresh_interval_seconds=30, fetch_timeout_seconds=5,
+            retry_after_seconds=30, max_pools=16):
+        self.region = region
+        self.key_builder = key_builder
+        self.ttl_seconds = ttl_seconds
+        self.min_refresh_interval_seconds = min_refresh_interval_seconds
+        self.fetch_timeout_seconds = fetch_timeout_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.max_pools = max_pools
+        self._entries = {}
+        self._refresh_locks = {}
+        self._refresh_locks_guard = threading.Lock()
+
+    def get_key(self, user_pool_id, kid):
+        """Returns the public key object for kid in the user pool, or None if the pool has no such key"""
+        entry = self._entries.get(user_pool_id)
+        now = time.monotonic()
+        if entry is not None and now < entry.expires_at:
+            public_key = entry.keys.get(kid)
+            if public_key is not None:
+                return public_key
+            if now - entry.fetched_at < self.min_refresh_interval_seconds:
+                # pool was refreshed recently, do not let unknown kids force a download on every call
+                return None
+
+        entry = self._refresh(user_pool_id, entry)
+        return entry.keys.get(kid)
+
+    def needs_refresh(self, user_pool_id):
+        """Returns True if the keys for the user pool are not cached or expired"""
+        entry = self._entries.get(user_pool_id)
+        return entry is None or time.monotonic() >= entry.expires_at
+
+    def prefetch(self, user_pool_id):
+        """Makes sure the keys for the user pool are cached, downloading them if needed"""
+        if self.needs_refresh(user_pool_id):
+            self._refresh(user_pool_id, self._entries.get(user_pool_id))
+
+    def invalidate(self, user_pool_id=None):
+        with self._refresh_locks_guard:
+            if user_pool_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_pool_id, None)
+            self._prune_refresh_locks()
+
+    def _refresh(self, user_pool_id, stale_entry):
+        with self._get_refresh_lock(user_pool_id):
+            current_entry = self._entries.get(user_pool_id)
+            if current_entry is not None and current_entry is not stale_entry:
+                # another thread refreshed the pool while we were waiting for the lock
+                return current_entry
+
+            try:
+                keys = self._fetch_keys(user_pool_id)
+            except Exception as e:
+                if stale_entry is None:
+                    raise
+                logger.error('Error refreshing jwks.json for user pool {0}, using cached keys: {1}'.format(user_pool_id, e))
+                # keep serving the stale keys and only retry after retry_after_seconds
+                now = time.monotonic()
+                entry = JwksEntry(stale_entry.keys, now, now + self.retry_after_seconds)
+                self._store(user_pool_id, entry)
+                return entry
+
+            now = time.monotonic()
+            entry = JwksEntry(keys, now, now + self.ttl_seconds)
+            self._store(user_pool_id, entry)
+            return entry
+
+    def _store(self, user_pool_id, entry):
+        with self._refresh_locks_guard:
+            self._entries[user_pool_id] = entry
+            while len(self._entries) > self.max_pools:
+                oldest_user_pool_id = min(self._entries, key=lambda pool_id: self._entries[pool_id].fetched_at)
+                del self._entries[oldest_user_pool_id]
+            self._prune_refresh_locks()
+
+    def _fetch_keys(self, user_pool_id):
+        keys_url = JWKS_URL_FORMAT.format(self.region, user_pool_id)
+        with urllib.request.urlopen(keys_url, timeout=self.fetch_timeout_seconds) as f:
+            response = f.read()
+        keys = json.loads(response.decode('utf-8'))['keys']
+        return {key['kid']: self.key_builder(key) for key in keys}
+
+    def _get_refresh_lock(self, user_pool_id):
+        with self._refresh_locks_guard:
+            lock = self._refresh_locks.get(user_pool_id)
+            if lock is None:
+                if len(self._refresh_locks) >= self.max_pools:
+                    self._prune_refresh_locks()
+                lock = threading.Lock()
+                self._refresh_locks[user_pool_id] = lock
+            return lock
+
+    def _prune_refresh_locks(self):
+        # called with _refresh_locks_guard held. Drops the locks of pools that are not cached,
+        # such as evicted pools or pools whose first download failed, unless a refresh holds them
+        for user_pool_id in list(self._refresh_locks):
+            if user_pool_id not in self._entries and not self._refresh_locks[user_pool_id].locked():
+                del self._refresh_locks[user_pool_id]
@@ -0,0 +1,102 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import base64
+import json
+import os
+from jose import jwk
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+SUPPORTED_ALGORITHM = 'RS256'
+
+
+class DecodedToken:
+    """A JWT split and decoded once: the header and claims are parsed, the signing input
+    and signature are kept as bytes for signature verification. Nothing is verified here."""
+
+    def __init__(self, token, header, claims, signing_input, signature):
+        self.token = token
+        self.header = header
+        self.claims = claims
+        self.signing_input = signing_input
+        self.signature = signature
+
+
+def decode_token(token):
+    """Splits the token into its three sections and decodes each of them exactly once
+
+    Raises:
+        ValueError: If the token is not a well formed JWS compact serialization
+    """
+    try:
+        encoded_header, encoded_claims, encoded_signature = token.split('.')
+        header = json.loads(base64url_decode(encoded_header))
+        claims = json.loads(base64url_decode(encoded_claims))
+        signature = base64url_decode(encoded_signature)
+    except Exception as e:
+        raise ValueError('Invalid JWT token', e)
+
+    signing_input = token[:len(encoded_header) + 1 + len(encoded_claims)].encode('utf-8')
+    return DecodedToken(token, header, claims, signing_input, signature)
+
+
+def base64url_decode(data):
+    data = data.encode('ascii')
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
+
+class JoseBackend:
+    """Verifies RS256 signatures with python-jose, as the authorizers always did"""
+    name = 'jose'
+
+    def construct_key(self, jwk_dict):
+        return jwk.construct(jwk_dict, algorithm=SUPPORTED_ALGORITHM)
+
+    def verify(self, public_key, signing_input, signature):
+        return public_key.verify(signing_input, signature)
+
+
+class CryptographyBackend:
+    """Verifies RS256 signatures with the cryptography package directly"""
+    name = 'cryptography'
+
+    def __init__(self):
+        self._padding = padding.PKCS1v15()
+        self._hash_algorithm = hashes.SHA256()
+
+    def construct_key(self, jwk_dict):
+        modulus = int.from_bytes(base64url_decode(jwk_dict['n']), 'big')
+        exponent = int.from_bytes(base64url_decode(jwk_dict['e']), 'big')
+        return rsa.RSAPublicNumbers(exponent, modulus).public_key()
+
+    def verify(self, public_key, signing_input, signature):
+        try:
+            public_key.verify(signature, signing_input, self._padding, self._hash_algorithm)
+        except InvalidSignature:
+            return False
+        return True
+
+
+BACKENDS = {
+    JoseBackend.name: JoseBackend,
+    CryptographyBackend.name: CryptographyBackend
+}
+
+
+def get_backend(name=None):
+    """Returns the signature verification backend called name, by default the one
+    selected with the JWT_VERIFIER_BACKEND environment variable (jose if not set)"""
+    if name is None:
+        name = os.environ.get('JWT_VERIFIER_BACKEND', JoseBackend.name)
+    if name not in BACKENDS:
+        raise ValueError('Unknown JWT verifier backend ' + name + '. Supported backends are ' + ', '.join(BACKENDS))
+    return BACKENDS[name]()
+
+
+def verify_signature(backend, public_key, decoded_token):
+    """Returns True if the token is RS256 signed and its signature matches the public key"""
+    if decoded_token.header.get('alg') != SUPPORTED_ALGORITHM:
+        return False
+    return backend.verify(public_key, decoded_token.signing_input, decoded_token.signature)
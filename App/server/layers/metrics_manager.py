@@ -2,14 +2,49 @@
 # SPDX-License-Identifier: MIT-0
 
 import json
+import time
+import functools
+import contextlib
 from aws_lambda_powertools import Metrics
+from aws_lambda_powertools.metrics import EphemeralMetrics
 import datetime
 
 metrics = Metrics()
+# the Milliseconds metrics of record_duration, broken down by tenantId. They are kept
+# in a metric set of their own, so that the metrics of record_metric keep their dimensions
+duration_metrics = EphemeralMetrics()
+
+# True while a handler decorated with flush_metrics runs. Metrics are then collected in
+# the metric sets (each prints itself once it holds 100 metrics) and printed when the
+# handler completes, one EMF document per metric set.
+__buffering = False
+
+
+def flush_metrics(handler):
+    """ Buffers the metrics recorded during the handler and prints them when it returns
+        or raises
+
+    Args:
+        handler ([type]): lambda handler to decorate
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global __buffering
+        metrics.clear_metrics()
+        duration_metrics.clear_metrics()
+        __add_duration_dimensions(event)
+        __buffering = True
+        try:
+            return handler(event, context)
+        finally:
+            __buffering = False
+            __flush()
+    return wrapper
 
 
 def record_metric(event, metric_name, metric_unit, metric_value):
-    """ Record the metric in Cloudwatch using EMF format
+    """ Record the metric in Cloudwatch using EMF format. Outside of a handler decorated
+        with flush_metrics the metric is printed right away.
 
     Args:
         event ([type]): [description]
@@ -19,7 +54,60 @@ def record_metric(event, metric_name, metric_unit, metric_value):
     """
     # Lab 2 - TODO - Add tenant context to the metrics layer in format metrics.add_dimension(name="Name", value="Value")
     metrics.add_metric(name=metric_name, unit=metric_unit, value=metric_value)
-    metrics_object = metrics.serialize_metric_set()
-    metrics.clear_metrics()
-    print(json.dumps(metrics_object))  
+    if (not __buffering):
+        __flush()
+
+
+def record_execution_time(metric_name):
+    """ Decorator recording the time the handler takes, in milliseconds, as metric_name.
+        Goes below flush_metrics so that the metric is part of the flushed document.
+
+    Args:
+        metric_name ([type]): name of the metric, e.g. GetProductExecutionTimeMs. Milliseconds
+            metrics are named with an Ms suffix so they do not share a series with the
+            older ...ExecutionTime metrics recorded in Seconds
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            with record_duration(event, metric_name):
+                return handler(event, context)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def record_duration(event, metric_name):
+    """ Context manager recording the time its block takes, in milliseconds, as metric_name,
+        with the tenantId of the event as dimension
+
+    Args:
+        event ([type]): [description]
+        metric_name ([type]): name of the metric, e.g. GetProductDalTimeMs
+    """
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        if (not __buffering):
+            __add_duration_dimensions(event)
+        duration_metrics.add_metric(name=metric_name, unit="Milliseconds", value=(time.perf_counter_ns() - start) / 1000000)
+        if (not __buffering):
+            __flush()
+
+
+def __add_duration_dimensions(event):
+    authorizer = (event.get('requestContext') or {}).get('authorizer') or {}
+    tenant_id = authorizer.get('tenantId')
+    if (tenant_id is not None):
+        duration_metrics.add_dimension(name="tenantId", value=str(tenant_id))
+
 
+def __flush():
+    for metric_set in [metrics, duration_metrics]:
+        try:
+            if (len(metric_set.metric_set) > 0):
+                metrics_object = metric_set.serialize_metric_set()
+                print(json.dumps(metrics_object))
+        finally:
+            metric_set.clear_metrics()
@@ -0,0 +1,45 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    """Thread-safe token bucket that lets at most rate_per_second calls through on average,
+    with bursts of up to burst calls. Shared by the threads of a container, so a fan-out
+    stays within the requests per second quota of the API it calls.
+    """
+
+    def __init__(self, rate_per_second, burst=None):
+        self.rate_per_second = float(rate_per_second)
+        self.burst = float(burst if burst is not None else rate_per_second)
+        self._tokens = self.burst
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """Blocks until a token is available and takes it.
+
+        Returns:
+            False if no token became available before deadline (a time.monotonic() value)
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate_per_second)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait_seconds = (1 - self._tokens) / self.rate_per_second
+
+            if deadline is not None and now + wait_seconds > deadline:
+                return False
+            time.sleep(wait_seconds)
+
+
+def backoff(attempt, base_delay_seconds, max_delay_seconds):
+    """Sleeps for an exponential backoff with full jitter before retry number attempt"""
+    time.sleep(random.uniform(0, min(max_delay_seconds, base_delay_seconds * (2 ** attempt))))
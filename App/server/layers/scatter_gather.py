@@ -0,0 +1,127 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+"""Fan-out helpers on a thread pool shared by all invocations of a container.
+
+Functions passed to scatter_gather must not wait on other work submitted to the pool: a
+worker blocked on a nested future holds its thread, and enough of them exhaust the pool and
+deadlock until the timeout. scatter_gather called from a pool thread therefore runs the
+calls inline, one after the other, instead of submitting them.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+
+__worker_state = threading.local()
+
+
+def __mark_worker():
+    __worker_state.is_worker = True
+
+
+# shared by all invocations of a container, so the number of threads stays bounded
+# no matter how many partitions a request fans out to
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get('SCATTER_GATHER_MAX_WORKERS', '10')), initializer=__mark_worker)
+
+
+class ScatterGatherTimeout(Exception):
+    pass
+
+
+def scatter_gather(function, arguments, timeout_seconds=None):
+    """Calls function(argument, deadline) for every argument on the shared thread pool and
+    returns the results in the order of arguments.
+
+    deadline is the time.monotonic() value by which all calls must complete (None without
+    timeout_seconds), long running calls can check it to stop early. When called from a
+    thread of the shared pool the calls run inline in the calling thread.
+
+    Raises:
+        The first exception raised by any of the calls, the calls not started yet are cancelled
+        ScatterGatherTimeout: If the calls did not complete within timeout_seconds
+    """
+    deadline = None
+    if timeout_seconds is not None:
+        deadline = time.monotonic() + timeout_seconds
+
+    if getattr(__worker_state, 'is_worker', False):
+        return __run_inline(function, arguments, deadline, timeout_seconds)
+
+    futures = [executor.submit(function, argument, deadline) for argument in arguments]
+    done, not_done = wait(futures, timeout=timeout_seconds, return_when=FIRST_EXCEPTION)
+
+    for future in futures:
+        if future in done and future.exception() is not None:
+            __cancel(not_done)
+            raise future.exception()
+
+    if len(not_done) > 0:
+        __cancel(not_done)
+        raise ScatterGatherTimeout('{0} of {1} calls did not complete within {2} seconds'.format(len(not_done), len(futures), timeout_seconds))
+
+    return [future.result() for future in futures]
+
+
+def query_all_pages(table, deadline=None, **query_arguments):
+    """Runs table.query following LastEvaluatedKey until all pages are read and returns all items
+
+    Raises:
+        ScatterGatherTimeout: If the deadline passes before the last page is read
+    """
+    items = []
+    while True:
+        response = table.query(**query_arguments)
+        items.extend(response['Items'])
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if last_evaluated_key is None:
+            return items
+        if deadline is not None and time.monotonic() > deadline:
+            raise ScatterGatherTimeout('Query did not read all pages before the deadline')
+        query_arguments['ExclusiveStartKey'] = last_evaluated_key
+
+
+def scan_all_pages(table, deadline=None, **scan_arguments):
+    """Runs table.scan following LastEvaluatedKey until all pages are read and returns all items
+
+    Raises:
+        ScatterGatherTimeout: If the deadline passes before the last page is read
+    """
+    items = []
+    while True:
+        response = table.scan(**scan_arguments)
+        items.extend(response['Items'])
+        last_evaluated_key = response.get('LastEvaluatedKey')
+        if last_evaluated_key is None:
+            return items
+        if deadline is not None and time.monotonic() > deadline:
+            raise ScatterGatherTimeout('Scan did not read all pages before the deadline')
+        scan_arguments['ExclusiveStartKey'] = last_evaluated_key
+
+
+def scan_all_segments(table, total_segments, timeout_seconds=None, **scan_arguments):
+    """Scans the whole table as total_segments parallel segments on the shared pool and
+    returns all items, a single segment is scanned without Segment/TotalSegments
+    """
+    if total_segments <= 1:
+        return scan_all_pages(table, None if timeout_seconds is None else time.monotonic() + timeout_seconds, **scan_arguments)
+
+    segments = scatter_gather(
+        lambda segment, deadline: scan_all_pages(table, deadline, Segment=segment, TotalSegments=total_segments, **scan_arguments),
+        range(total_segments), timeout_seconds=timeout_seconds)
+    return [item for segment in segments for item in segment]
+
+
+def __run_inline(function, arguments, deadline, timeout_seconds):
+    results = []
+    for argument in arguments:
+        if deadline is not None and time.monotonic() > deadline:
+            raise ScatterGatherTimeout('Calls did not complete within {0} seconds'.format(timeout_seconds))
+        results.append(function(argument, deadline))
+    return results
+
+
+def __cancel(futures):
+    for future in futures:
+        future.cancel()
@@ -0,0 +1,49 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import zlib
+
+import utils
+
+# tenants created before the shard count was stored with the tenant record wrote
+# their items to the random shards tenantId-1..9
+LEGACY_SHARD_COUNT = 9
+
+# write shards given to new tenants of each tier
+TIER_SHARD_COUNTS = {
+    utils.TenantTier.BASIC.value.upper(): 1,
+    utils.TenantTier.STANDARD.value.upper(): 3,
+    utils.TenantTier.PREMIUM.value.upper(): 9,
+    utils.TenantTier.PLATINUM.value.upper(): 16
+}
+
+
+def get_tier_shard_count(tenant_tier):
+    return TIER_SHARD_COUNTS.get(tenant_tier.upper(), LEGACY_SHARD_COUNT)
+
+
+def get_shard_count_for_tier_change(current_shard_count, tenant_tier):
+    """Returns the shard count of a tenant moving to tenant_tier. Shards are only ever
+    added, items already written to the current shards must stay readable."""
+    if current_shard_count is None:
+        current_shard_count = LEGACY_SHARD_COUNT
+    return max(int(current_shard_count), get_tier_shard_count(tenant_tier))
+
+
+def get_shard_count(event):
+    """Returns the shard count of the calling tenant, passed by the authorizer"""
+    shard_count = event['requestContext']['authorizer'].get('shardCount')
+    if shard_count is None:
+        return LEGACY_SHARD_COUNT
+    return int(shard_count)
+
+
+def get_shard_id(tenant_id, item_id, shard_count):
+    """Returns the shard an item is written to, the same one for a given item id"""
+    suffix = zlib.crc32(item_id.encode('utf-8')) % shard_count + 1
+    return tenant_id + '-' + str(suffix)
+
+
+def get_partition_ids(tenant_id, shard_count):
+    """Returns the active shards of the tenant, the only ones reads need to query"""
+    return [tenant_id + '-' + str(suffix) for suffix in range(1, shard_count + 1)]
@@ -0,0 +1,180 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import base64
+import heapq
+import json
+import os
+
+import scatter_gather
+from boto3.dynamodb.conditions import Key
+
+# largest page a client can ask for, each page reads at most this many items per shard
+max_page_limit = int(os.environ.get('MAX_PAGE_LIMIT', '100'))
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class ShardCursor:
+    """Position of a paginated read in every shard of a tenant.
+
+    last_keys holds the sort key of the last item returned from each shard that was
+    started, exhausted the shards that have no more items. Shards in neither are read
+    from their beginning.
+    """
+
+    def __init__(self, last_keys=None, exhausted=None):
+        self.last_keys = last_keys or {}
+        self.exhausted = set(exhausted or [])
+
+
+def encode_cursor(cursor):
+    """Returns the opaque nextToken of the cursor, or None once every shard is exhausted"""
+    if len(cursor.last_keys) == 0 and len(cursor.exhausted) == 0:
+        return None
+    data = json.dumps({'k': cursor.last_keys, 'x': sorted(cursor.exhausted)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(next_token, partition_ids):
+    """Returns the ShardCursor of next_token (a new cursor if None)
+
+    Raises:
+        InvalidCursor: If the token is malformed, holds a sort key that is not a string or
+            names a shard not in partition_ids
+    """
+    if next_token is None:
+        return ShardCursor()
+    try:
+        data = json.loads(base64.urlsafe_b64decode(next_token + '=' * (-len(next_token) % 4)))
+        cursor = ShardCursor(dict(data['k']), data['x'])
+    except Exception as e:
+        raise InvalidCursor('Invalid nextToken', e)
+
+    # the sort keys reach table.query as ExclusiveStartKey, anything but a string would fail there
+    if not all(isinstance(last_key, str) for last_key in cursor.last_keys.values()):
+        raise InvalidCursor('Invalid nextToken')
+
+    # a cursor must never move the read to partitions of another tenant
+    for partition_id in list(cursor.last_keys) + list(cursor.exhausted):
+        if partition_id not in partition_ids:
+            raise InvalidCursor('Invalid nextToken')
+    return cursor
+
+
+def parse_limit(limit):
+    """Returns limit as an int between 1 and max_page_limit
+
+    Raises:
+        ValueError: If limit is not a positive integer
+    """
+    limit = int(limit)
+    if limit < 1:
+        raise ValueError('limit must be a positive integer')
+    return min(limit, max_page_limit)
+
+
+def query_page(table, partition_key_name, sort_key_name, partition_ids, limit, next_token=None, timeout_seconds=None):
+    """Reads one page of at most limit items from the partitions, ordered by sort key.
+
+    Every shard that is not exhausted is queried concurrently for at most limit items
+    after its position in next_token and the results are merged, so a page holds at
+    most limit items per shard in memory no matter how large the tenant is.
+
+    Returns:
+        (items, next_token) where next_token is None after the last page
+    """
+    cursor = decode_cursor(next_token, partition_ids)
+    active_partition_ids = [partition_id for partition_id in partition_ids if partition_id not in cursor.exhausted]
+
+    responses = scatter_gather.scatter_gather(
+        lambda partition_id, deadline: __query_shard(table, partition_key_name, sort_key_name, partition_id, cursor.last_keys.get(partition_id), limit),
+        active_partition_ids, timeout_seconds=timeout_seconds)
+
+    # a shard that stopped before limit items (1 MB response size) and still has items sets
+    # an upper bound, merging past it could skip items of that shard on the next page
+    upper_bound = None
+    for items, has_more in responses:
+        if has_more and len(items) > 0:
+            last_sort_key = items[-1][sort_key_name]
+            if upper_bound is None or last_sort_key < upper_bound:
+                upper_bound = last_sort_key
+
+    shards = [[(item[sort_key_name], index, item) for item in items] for index, (items, has_more) in enumerate(responses)]
+    page = []
+    consumed = [0] * len(responses)
+    for sort_key, index, item in heapq.merge(*shards):
+        if len(page) == limit or (upper_bound is not None and sort_key > upper_bound):
+            break
+        page.append(item)
+        consumed[index] += 1
+
+    next_cursor = ShardCursor(dict(cursor.last_keys), cursor.exhausted)
+    for index, partition_id in enumerate(active_partition_ids):
+        items, has_more = responses[index]
+        if consumed[index] == len(items) and not has_more:
+            next_cursor.last_keys.pop(partition_id, None)
+            next_cursor.exhausted.add(partition_id)
+        elif consumed[index] > 0:
+            next_cursor.last_keys[partition_id] = items[consumed[index] - 1][sort_key_name]
+
+    if len(next_cursor.exhausted) == len(partition_ids):
+        return page, None
+    return page, encode_cursor(next_cursor)
+
+
+def encode_start_key(last_evaluated_key):
+    """Returns the opaque nextToken of a LastEvaluatedKey, or None after the last page"""
+    if last_evaluated_key is None:
+        return None
+    data = json.dumps(last_evaluated_key, separators=(',', ':'), sort_keys=True)
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_start_key(next_token, key_names):
+    """Returns the ExclusiveStartKey of next_token (None if next_token is None)
+
+    Raises:
+        InvalidCursor: If the token is malformed or is not a key made of key_names
+    """
+    if next_token is None:
+        return None
+    try:
+        start_key = json.loads(base64.urlsafe_b64decode(next_token + '=' * (-len(next_token) % 4)))
+    except Exception as e:
+        raise InvalidCursor('Invalid nextToken', e)
+
+    if (not isinstance(start_key, dict) or set(start_key) != set(key_names)
+            or not all(isinstance(value, str) for value in start_key.values())):
+        raise InvalidCursor('Invalid nextToken')
+    return start_key
+
+
+def scan_page(table, key_names, limit, next_token=None, **scan_arguments):
+    """Reads one page of at most limit items of the table, continuing after next_token.
+
+    key_names are the names of the (string) key attributes of the table, the only
+    attributes a nextToken may hold.
+
+    Returns:
+        (items, next_token) where next_token is None after the last page
+    """
+    scan_arguments['Limit'] = limit
+    start_key = decode_start_key(next_token, key_names)
+    if start_key is not None:
+        scan_arguments['ExclusiveStartKey'] = start_key
+    response = table.scan(**scan_arguments)
+    return response['Items'], encode_start_key(response.get('LastEvaluatedKey'))
+
+
+def __query_shard(table, partition_key_name, sort_key_name, partition_id, last_sort_key, limit):
+    query_arguments = {
+        'KeyConditionExpression': Key(partition_key_name).eq(partition_id),
+        'Limit': limit
+    }
+    if last_sort_key is not None:
+        query_arguments['ExclusiveStartKey'] = {partition_key_name: partition_id, sort_key_name: last_sort_key}
+    response = table.query(**query_arguments)
+    return response['Items'], 'LastEvaluatedKey' in response
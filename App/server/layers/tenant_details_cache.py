@@ -0,0 +1,125 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+import logger
+from cache_manager import LruTtlCache, MISSING
+
+TENANT_DETAILS_TABLE_NAME = 'SaaSOperations-TenantDetails'
+SETTINGS_TABLE_NAME = 'SaaSOperations-Settings'
+CACHE_GENERATION_SETTING_NAME = 'tenantDetailsCacheGeneration'
+
+# only the attributes the authorizers need, apiKey, pool ids and shard count included
+TENANT_DETAILS_PROJECTION = 'tenantId, tenantName, tenantTier, shardCount, userPoolId, identityPoolId, appClientId, apiKey, apiGatewayUrl'
+
+cache_ttl_seconds = int(os.environ.get('TENANT_DETAILS_CACHE_TTL_SECONDS', '300'))
+negative_cache_ttl_seconds = int(os.environ.get('TENANT_DETAILS_NEGATIVE_CACHE_TTL_SECONDS', '30'))
+cache_max_size = int(os.environ.get('TENANT_DETAILS_CACHE_MAX_SIZE', '1000'))
+generation_poll_seconds = int(os.environ.get('TENANT_DETAILS_CACHE_GENERATION_POLL_SECONDS', '30'))
+
+dynamodb = boto3.resource('dynamodb')
+table_tenant_details = dynamodb.Table(TENANT_DETAILS_TABLE_NAME)
+table_system_settings = dynamodb.Table(SETTINGS_TABLE_NAME)
+
+tenant_details_cache = LruTtlCache(max_size=cache_max_size, ttl_seconds=cache_ttl_seconds)
+
+# the cache generation is read by a background thread, never on the request path
+__generation_executor = ThreadPoolExecutor(max_workers=1)
+__generation_lock = threading.Lock()
+__generation = None
+__generation_checked_at = None
+__generation_future = None
+
+
+def get_tenant_details(tenant_id):
+    """Returns the projected tenant record for tenant_id, or None if the tenant does not exist.
+
+    Records (and misses, for a shorter time) are cached in process. Entries are dropped
+    before their TTL when invalidate_tenant_details is called from any container, once the
+    background check of the cache generation sees the change.
+    """
+    __check_cache_generation()
+
+    tenant_details = tenant_details_cache.get(tenant_id)
+    if tenant_details is not MISSING:
+        return tenant_details
+
+    response = table_tenant_details.get_item(
+        Key={
+            'tenantId': tenant_id
+        },
+        ProjectionExpression=TENANT_DETAILS_PROJECTION
+    )
+    tenant_details = response.get('Item')
+    if tenant_details is None:
+        tenant_details_cache.put(tenant_id, None, ttl_seconds=negative_cache_ttl_seconds)
+    else:
+        tenant_details_cache.put(tenant_id, tenant_details)
+    return tenant_details
+
+
+def invalidate_tenant_details(tenant_id):
+    """Drops the cached record of the tenant. Call this after changing the tenant record,
+    for example its tier or its active flag.
+
+    The entry is dropped from this process right away. The cache generation stored in the
+    settings table is bumped as well, so the authorizers running in other containers
+    clear their caches the next time they check it.
+    """
+    tenant_details_cache.invalidate(tenant_id)
+    try:
+        table_system_settings.update_item(
+            Key={
+                'settingName': CACHE_GENERATION_SETTING_NAME
+            },
+            UpdateExpression="add settingValue :increment",
+            ExpressionAttributeValues={
+                ':increment': 1
+            }
+        )
+    except Exception as e:
+        logger.error('Error invalidating cached details of tenant {0}: {1}'.format(tenant_id, e))
+
+
+def __check_cache_generation():
+    """Starts a background read of the cache generation at most every generation_poll_seconds,
+    the request carries on with the cache as it is"""
+    global __generation_checked_at, __generation_future
+
+    now = time.monotonic()
+    if __generation_checked_at is not None and now - __generation_checked_at < generation_poll_seconds:
+        return
+
+    with __generation_lock:
+        if __generation_checked_at is not None and now - __generation_checked_at < generation_poll_seconds:
+            return
+        if __generation_future is not None and not __generation_future.done():
+            return
+        __generation_checked_at = now
+        __generation_future = __generation_executor.submit(__refresh_cache_generation)
+
+
+def __refresh_cache_generation():
+    global __generation
+
+    try:
+        response = table_system_settings.get_item(
+            Key={
+                'settingName': CACHE_GENERATION_SETTING_NAME
+            }
+        )
+        generation = response.get('Item', {}).get('settingValue', 0)
+    except Exception as e:
+        # keep serving from the cache, the TTL still bounds staleness
+        logger.error('Error reading tenant details cache generation: {0}'.format(e))
+        return
+
+    if __generation is not None and generation != __generation:
+        tenant_details_cache.clear()
+    __generation = generation
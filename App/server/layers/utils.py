@@ -10,6 +10,9 @@ import datetime
 import boto3
 from aws_requests_auth.aws_auth import AWSRequestsAuth
 from enum import Enum
+from types import SimpleNamespace
+
+DEFAULT_PAGE_LIMIT = 50
 
 class TenantTier(Enum):
     PLATINUM    = "Platinum"
@@ -20,8 +23,11 @@ class TenantTier(Enum):
 
 class StatusCodes(Enum):
     SUCCESS    = 200
+    BAD_REQUEST = 400
     UN_AUTHORIZED  = 401
     NOT_FOUND = 404
+    CONFLICT = 409
+    SERVICE_UNAVAILABLE = 503
     
 class Service_Identifier(Enum):
     SHARED_SERVICES     = "SharedServices"
@@ -53,6 +59,19 @@ def create_unauthorized_response():
         }),
     }
 
+def create_badrequest_response(message):
+    return {
+        "statusCode": StatusCodes.BAD_REQUEST.value,
+        "headers": {
+            "Access-Control-Allow-Headers" : "Content-Type",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "OPTIONS,POST,GET,PUT"
+        },
+        "body": json.dumps({
+            "message": message
+        }),
+    }
+
 def create_notfound_response(message):
     return {
         "statusCode": StatusCodes.NOT_FOUND.value,
@@ -66,6 +85,32 @@ def create_notfound_response(message):
         }),
     }
 
+def create_conflict_response(message):
+    return {
+        "statusCode": StatusCodes.CONFLICT.value,
+        "headers": {
+            "Access-Control-Allow-Headers" : "Content-Type",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "OPTIONS,POST,GET,PUT"
+        },
+        "body": json.dumps({
+            "message": message
+        }),
+    }
+
+def create_service_unavailable_response(message):
+    return {
+        "statusCode": StatusCodes.SERVICE_UNAVAILABLE.value,
+        "headers": {
+            "Access-Control-Allow-Headers" : "Content-Type",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "OPTIONS,POST,GET,PUT"
+        },
+        "body": json.dumps({
+            "message": message
+        }),
+    }
+
 def get_auth(host, region):
     session = boto3.Session()
     credentials = session.get_credentials()
@@ -93,10 +138,41 @@ def generate_response(inputObject):
     }
 
 def  encode_to_json_object(inputObject):
-    jsonpickle.set_encoder_options('simplejson', use_decimal=True, sort_keys=True)
-    jsonpickle.set_preferred_backend('simplejson')
+    """ Encodes the response body. Models, namespaces and Decimals are converted directly by
+        the preconfigured encoder, anything else falls back to jsonpickle. Both produce the
+        same JSON.
+    """
+    try:
+        return json_encoder.encode(inputObject)
+    except TypeError:
+        return encode_with_jsonpickle(inputObject)
+
+def encode_with_jsonpickle(inputObject):
     return jsonpickle.encode(inputObject, unpicklable=False, use_decimal=True)
 
+def to_serializable(inputObject):
+    """ default hook of json_encoder, called for values simplejson does not encode natively """
+    if hasattr(inputObject, 'to_dict'):
+        return inputObject.to_dict()
+    if isinstance(inputObject, SimpleNamespace):
+        return vars(inputObject)
+    raise TypeError('Object of type ' + type(inputObject).__name__ + ' is not handled by the fast encoder')
+
+jsonpickle.set_encoder_options('simplejson', use_decimal=True, sort_keys=True)
+jsonpickle.set_preferred_backend('simplejson')
+
+# built once per container with the options jsonpickle encodes with
+json_encoder = simplejson.JSONEncoder(sort_keys=True, use_decimal=True, default=to_serializable)
+
+
+def get_pagination_parameters(event):
+    """ Returns (limit, nextToken) from the query string, or None when the request
+        does not ask for a page
+    """
+    query_parameters = event.get('queryStringParameters') or {}
+    if ('limit' not in query_parameters and 'nextToken' not in query_parameters):
+        return None
+    return query_parameters.get('limit', DEFAULT_PAGE_LIMIT), query_parameters.get('nextToken')
 
 def getUTCEpoch():
     dt = datetime.datetime.now(timezone.utc)
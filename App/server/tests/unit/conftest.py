@@ -0,0 +1,12 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import os
+import sys
+
+# the lambda layer modules are imported by their module name, as they are in lambda
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'layers'))
+
+# so are the models of the services, from their CodeUri directories
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'ProductService'))
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', '..', 'OrderService'))
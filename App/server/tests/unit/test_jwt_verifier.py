@@ -0,0 +1,72 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import base64
+import json
+import time
+
+import pytest
+
+pytest.importorskip("jose")
+pytest.importorskip("cryptography")
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+import jwt_verifier
+
+
+def _base64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _base64url_uint(value):
+    return _base64url_encode(value.to_bytes((value.bit_length() + 7) // 8, 'big'))
+
+
+@pytest.fixture(scope="module")
+def signing_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture(scope="module")
+def public_jwk(signing_key):
+    public_numbers = signing_key.public_key().public_numbers()
+    return {
+        "kid": "test-key",
+        "alg": "RS256",
+        "kty": "RSA",
+        "use": "sig",
+        "n": _base64url_uint(public_numbers.n),
+        "e": _base64url_uint(public_numbers.e)
+    }
+
+
+@pytest.fixture(scope="module")
+def token(signing_key):
+    header = {"kid": "test-key", "alg": "RS256"}
+    claims = {
+        "sub": "aaaaaaaa-bbbb-cccc-dddd-eeeeeeeeeeee",
+        "aud": "app-client-id",
+        "iss": "https://cognito-idp.us-east-1.amazonaws.com/us-east-1_example",
+        "cognito:username": "tenant-admin",
+        "custom:tenantId": "tenant-1",
+        "custom:userRole": "TenantAdmin",
+        "exp": int(time.time()) + 3600
+    }
+    signing_input = _base64url_encode(json.dumps(header).encode('utf-8')) + '.' + _base64url_encode(json.dumps(claims).encode('utf-8'))
+    signature = signing_key.sign(signing_input.encode('utf-8'), padding.PKCS1v15(), hashes.SHA256())
+    return signing_input + '.' + _base64url_encode(signature)
+
+
+@pytest.mark.parametrize("backend_name", sorted(jwt_verifier.BACKENDS))
+def test_verify_rejects_tampered_token(backend_name, public_jwk, token):
+    backend = jwt_verifier.get_backend(backend_name)
+    public_key = backend.construct_key(public_jwk)
+
+    assert jwt_verifier.verify_signature(backend, public_key, jwt_verifier.decode_token(token))
+
+    header, claims, signature = token.split('.')
+    tampered_claims = _base64url_encode(json.dumps({"custom:tenantId": "tenant-2"}).encode('utf-8'))
+    tampered_token = '.'.join([header, tampered_claims, signature])
+    assert not jwt_verifier.verify_signature(backend, public_key, jwt_verifier.decode_token(tampered_token))
@@ -0,0 +1,24 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("jose")
+pytest.importorskip("cryptography")
+
+import jwt_verifier
+
+from .test_jwt_verifier import signing_key, public_jwk, token
+
+
+@pytest.mark.parametrize("backend_name", sorted(jwt_verifier.BACKENDS))
+def test_verify_throughput(benchmark, backend_name, public_jwk, token):
+    backend = jwt_verifier.get_backend(backend_name)
+    public_key = backend.construct_key(public_jwk)
+
+    def decode_and_verify():
+        return jwt_verifier.verify_signature(backend, public_key, jwt_verifier.decode_token(token))
+
+    benchmark.group = "jwt-verify"
+    assert benchmark(decode_and_verify)
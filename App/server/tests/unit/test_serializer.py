@@ -0,0 +1,41 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("jsonpickle")
+pytest.importorskip("simplejson")
+
+import utils
+from order_models import Order, OrderProduct
+from product_models import Product
+
+
+def _products(count):
+    return [Product('tenant-1-' + str(i % 9 + 1), 'product-' + str(i), 'sku-' + str(i), 'Product ' + str(i), Decimal('19.99'), 'category-' + str(i % 5))
+            for i in range(count)]
+
+
+def _orders(count):
+    return [Order('tenant-1-' + str(i % 9 + 1), 'order-' + str(i), 'Order ' + str(i),
+                  [{'productId': 'product-' + str(i), 'price': Decimal('19.99'), 'quantity': Decimal(i % 4 + 1)},
+                   OrderProduct('product-' + str(i + 1), Decimal('5.5'), 2),
+                   SimpleNamespace(productId='product-' + str(i + 2), price=Decimal('1'), quantity=1)])
+            for i in range(count)]
+
+
+@pytest.mark.parametrize("response", [
+    _products(10),
+    _orders(10),
+    {'items': _products(3), 'nextToken': None},
+    {'tenantId': 'tenant-1', 'isActive': True, 'shardCount': Decimal(3), 'ratio': 0.5},
+    [{'unicode': 'café', 'nested': {'b': 1, 'a': [1, 2.5, None]}}],
+    {'tags': {'a'}}
+])
+def test_fast_encoder_matches_jsonpickle(response):
+    assert utils.encode_to_json_object(response) == utils.encode_with_jsonpickle(response)
+    json.loads(utils.encode_to_json_object(response))
@@ -0,0 +1,22 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: MIT-0
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+pytest.importorskip("jsonpickle")
+pytest.importorskip("simplejson")
+
+import utils
+
+from .test_serializer import _products, _orders
+
+ITEM_COUNT = 10000
+
+
+@pytest.mark.parametrize("encoder", [utils.encode_to_json_object, utils.encode_with_jsonpickle], ids=["fast", "jsonpickle"])
+@pytest.mark.parametrize("items", [_products, _orders], ids=["products", "orders"])
+def test_encode_throughput(benchmark, encoder, items):
+    response = items(ITEM_COUNT)
+    benchmark.group = "encode-" + items.__name__.strip('_')
+    assert benchmark(encoder, response)
@@ -1,20 +1,93 @@
 # Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 # SPDX-License-Identifier: MIT-0
 
+import os
+import random
+import logging
+import functools
 from aws_lambda_powertools import Logger
 logger = Logger()
 
-"""Log info messages
+# share of invocations that emit each level, e.g. LOG_SAMPLE_RATE_DEBUG=0.1 keeps the
+# debug logs of one invocation in ten. Sampling is decided once per invocation, by
+# handlers decorated with sample_invocation, so an invocation logs either all or none
+# of its messages of a level.
+sample_rates = {
+    logging.DEBUG: float(os.environ.get('LOG_SAMPLE_RATE_DEBUG', '1')),
+    logging.INFO: float(os.environ.get('LOG_SAMPLE_RATE_INFO', '1')),
+    logging.ERROR: float(os.environ.get('LOG_SAMPLE_RATE_ERROR', '1'))
+}
+
+__log_functions = {
+    logging.DEBUG: logger.debug,
+    logging.INFO: logger.info,
+    logging.ERROR: logger.error
+}
+
+__bound_event = None
+__sampled_event = None
+__sampled_levels = {level: True for level in sample_rates}
+
+"""Log debug messages. log_message can be a callable, called only if the message is logged
+"""
+def debug(log_message):
+    __log(logging.DEBUG, log_message)
+
+"""Log info messages. log_message can be a callable, called only if the message is logged
 """
 def info(log_message):  
-    logger.info (log_message)
+    __log(logging.INFO, log_message)
 
-"""Log error messages
+"""Log error messages. log_message can be a callable, called only if the message is logged
 """
 def error(log_message):
-    logger.error (log_message)
+    __log(logging.ERROR, log_message)
 
 
 def log_message(event, log_message):
-    logger.structure_logs(append=True, tenantId=event['requestContext']['authorizer']['tenantId'], tenantName=event['requestContext']['authorizer']['tenantName'], tenantTier=event['requestContext']['authorizer']['tenantTier'])
-    logger.info (log_message)
+    bind_tenant_context(event)
+    __log(logging.INFO, log_message)
+
+
+def sample_invocation(handler):
+    """ Draws the sampling decisions of the invocation before the handler runs, so
+        every message of the invocation is sampled the same way, including those logged
+        before or without log_message
+
+    Args:
+        handler ([type]): lambda handler to decorate
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        __draw_sample(event)
+        return handler(event, context)
+    return wrapper
+
+
+def bind_tenant_context(event):
+    """ Adds the tenant context of the invocation to all following log lines. Only does
+        work for the first call with a given event. Draws the sampling decisions of the
+        invocation if its handler is not decorated with sample_invocation.
+    """
+    global __bound_event
+    if event is __bound_event:
+        return
+    __bound_event = event
+    if event is not __sampled_event:
+        __draw_sample(event)
+    logger.append_keys(tenantId=event['requestContext']['authorizer']['tenantId'], tenantName=event['requestContext']['authorizer']['tenantName'], tenantTier=event['requestContext']['authorizer']['tenantTier'])
+
+
+def __draw_sample(event):
+    global __sampled_event, __sampled_levels
+    __sampled_event = event
+    __sampled_levels = {level: rate >= 1 or random.random() < rate for level, rate in sample_rates.items()}
+
+
+def __log(level, log_message):
+    if not __sampled_levels[level] or not logger.isEnabledFor(level):
+        return
+    if callable(log_message):
+        log_message = log_message()
+    # stacklevel 4 reports the location of the code that called info, error or log_message
+    __log_functions[level](log_message, stacklevel=4)